@@ -82,6 +82,18 @@ DATABASES = {
     }
 }
 
+# Setting the POSTGRES_DB environment variable uses PostgreSQL instead, which
+# bulk loads with COPY; see scraping/database.py. Needs psycopg2.
+if os.environ.get('POSTGRES_DB'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', ''),
+        'PORT': os.environ.get('POSTGRES_PORT', ''),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -120,3 +132,33 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Tumblr API response cache
+# Modes are 'off', 'cache', 'record' and 'replay'; see scraping/http_cache.py.
+# The TUMBLR_CACHE_MODE environment variable overrides the mode.
+
+TUMBLR_CACHE = {
+    'directory': os.path.join(BASE_DIR, 'cache', 'tumblr'),
+    'mode': 'off',
+    'ttl': 24 * 60 * 60,
+    'max_size': 1024 ** 3,
+}
+
+
+# Where the photo similarity index is saved between runs; see
+# scraping/similarity.py
+
+SIMILARITY_INDEX = os.path.join(BASE_DIR, 'cache', 'similarity.npz')
+
+
+# Where downloaded images are kept, named by their SHA-256; see
+# scraping/downloads.py
+
+PHOTO_STORE = os.path.join(BASE_DIR, 'photos')
+
+
+# Extra or different pragmas for SQLite connections; see SQLITE_PRAGMAS in
+# scraping/database.py
+
+SQLITE_PRAGMAS = {}
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+# An HTTPAdapter that gives requests a default timeout, since tumblpy doesn't
+# set one.
+class TimeoutAdapter(HTTPAdapter):
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+# Returns a TimeoutAdapter that keeps up to pool_size connections open to each
+# host and retries failed requests (connection errors, 429s and 5xxs) with
+# exponential backoff.
+#   retries (int):
+#       the maximum number of times to retry a request.
+#   backoff (float):
+#       urllib3's backoff factor, in seconds. The first retry is made at
+#       once, and each retry n after it waits backoff * 2 ** (n - 1): with 0.5,
+#       the second waits 1 second and the third 2.
+def pooled_adapter(pool_size=10, timeout=(5, 30), retries=3, backoff=0.5):
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  raise_on_status=False)
+    return TimeoutAdapter(timeout=timeout, pool_connections=pool_size,
+                          pool_maxsize=pool_size, max_retries=retry)
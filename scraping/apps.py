@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+class ScrapingConfig(AppConfig):
+    name = 'scraping'
+
+    def ready(self):
+        from scraping import database
+        connection_created.connect(database.configure_connection)
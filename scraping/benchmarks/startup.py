@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+
+# Modules that are slow to import and only needed by some commands, so
+# shouldn't be imported just by loading the app
+HEAVY_MODULES = ['nltk', 'tumblpy', 'requests', 'numpy', 'scipy', 'PIL']
+
+# Run in a fresh interpreter, since modules already imported here would make
+# the import look free
+SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+for module in {modules!r}:
+    __import__(module)
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds,
+                   'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+# Returns how long a fresh interpreter takes to set up Django and import
+# modules, as a dict with the 'seconds' each run took and the 'heavy' modules
+# that were imported along the way.
+#   modules (list):
+#       the modules to import after setting up Django.
+#   runs (int):
+#       the number of interpreters to time.
+def measure(modules=('scraping.models', 'scraping.admin'), runs=5):
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'photo_scraper.settings')
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    script = SCRIPT.format(modules=list(modules), heavy=HEAVY_MODULES)
+    results = {'seconds': [], 'heavy': set()}
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=root, env=env)
+        result = json.loads(output.decode('utf-8').splitlines()[-1])
+        results['seconds'].append(result['seconds'])
+        results['heavy'].update(result['heavy'])
+    results['heavy'] = sorted(results['heavy'])
+    return results
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+
+ADJECTIVES = ['little', 'big', 'wild', 'young', 'sleepy', 'hungry', 'golden',
+              'fierce', 'playful', 'majestic', 'tiny', 'spotted', 'striped',
+              'beautiful', 'lazy', 'curious', 'proud', 'gentle', 'early',
+              'quiet']
+NOUNS = ['lion', 'lions', 'cub', 'cubs', 'elephant', 'elephants', 'leopard',
+         'cheetah', 'giraffe', 'zebra', 'hippo', 'rhino', 'buffalo', 'eagle',
+         'owl', 'bear', 'wolf', 'fox', 'tiger', 'monkey', 'baby', 'mother',
+         'herd', 'pride', 'river', 'tree', 'grass', 'sunset', 'morning',
+         'safari', 'savannah', 'africa', 'kenya', 'photo', 'wildlife',
+         'nature', 'animal', 'animals', 'hook', 'day']
+VERBS = ['frolicking', 'playing', 'running', 'sleeping', 'hunting', 'eating',
+         'drinking', 'watching', 'resting', 'jumping', 'climbing', 'roaring',
+         'walks', 'looks', 'waits', 'stalks']
+OTHER = ['the', 'a', 'in', 'on', 'at', 'with', 'and', 'of', 'this', 'after',
+         'nice', 'left', 'very', 'just', 'so']
+TAGS = ['big cats', 'animals', 'baby animals', 'lions', 'wildlife photography',
+        'nature', 'africa', 'safari', 'elephants', 'birds of prey', 'wildlife',
+        'photography', 'cute animals', 'leopards', 'national geographic',
+        'cheetahs', 'kenya', 'tanzania', 'animal photography', 'cubs']
+
+
+# Returns a list of fake photo posts shaped like those from the Tumblr API
+# (see POST in scraping/tests.py), newest first.
+#   count (int):
+#       the number of posts.
+#   caption_words (int):
+#       the number of words in each caption.
+#   tags (int):
+#       the number of tags on each post.
+#   photos (int):
+#       the number of photos in each post.
+#   notes (int):
+#       the number of notes on each post. About two thirds are likes.
+#   blog_name (str):
+#       the name of the blog the posts are from.
+#   seed (int):
+#       seeds the random choices, so the same arguments give the same posts.
+def make_posts(count, caption_words=12, tags=5, photos=1, notes=50,
+               blog_name='synthetic', seed=0):
+    rng = random.Random(seed)
+    start = 1469174714
+    posts = []
+    for i in range(count):
+        post_id = 147789058287 + count - i
+        timestamp = start - i * 3600
+        caption = '<p>{}</p>'.format(make_caption(rng, caption_words))
+        post = {
+            'type': 'photo',
+            'id': post_id,
+            'blog_name': blog_name,
+            'post_url': 'http://{}.tumblr.com/post/{}/{}'.format(
+                blog_name, post_id, 'synthetic-post'),
+            'timestamp': timestamp,
+            'caption': caption,
+            'summary': caption[3:-4],
+            'tags': rng.sample(TAGS, min(tags, len(TAGS))),
+            'note_count': notes,
+            'notes': [make_note(rng, timestamp + n) for n in range(notes)],
+            'photos': [make_photo(post_id, n) for n in range(photos)],
+        }
+        posts.append(post)
+    return posts
+
+
+def make_caption(rng, length):
+    words = []
+    for _ in range(length):
+        words.append(rng.choice(rng.choice([ADJECTIVES, NOUNS, NOUNS, VERBS,
+                                            OTHER])))
+    if words:
+        words[0] = words[0].capitalize()
+        words[-1] += rng.choice(['.', '!', '', '...'])
+    return ' '.join(words)
+
+
+def make_note(rng, timestamp):
+    name = 'user{}'.format(rng.randint(0, 10 ** 6))
+    note = {'avatar_shape': 'square',
+            'type': 'like' if rng.random() < 2 / 3 else 'reblog',
+            'blog_uuid': name + '.tumblr.com',
+            'blog_url': 'http://{}.tumblr.com/'.format(name),
+            'blog_name': name,
+            'followed': False,
+            'timestamp': timestamp}
+    if note['type'] == 'reblog':
+        note['post_id'] = str(rng.randint(10 ** 11, 10 ** 12))
+    return note
+
+
+def make_photo(post_id, number):
+    url = 'https://66.media.tumblr.com/{}/tumblr_synthetic{}_{}.jpg'.format(
+        post_id, number, 1280)
+    return {'caption': '',
+            'original_size': {'height': 871, 'width': 1280, 'url': url},
+            'alt_sizes': [{'height': 340, 'width': 500,
+                           'url': url.replace('1280', '500')}]}
+
+
+# A local stand-in for the Tumblr API, serving a fixed list of posts. Has the
+# same get method as TumblrClient, so it can be swapped in with
+# scraping.tumblr.set_client.
+#   posts (list):
+#       the blog's posts, newest first.
+#   info (dict):
+#       the blog's info, as returned for the 'info' endpoint.
+class StandInClient(object):
+
+    def __init__(self, posts, info=None):
+        self.posts = posts
+        self.info = info or {'blog': {'url': 'http://synthetic.tumblr.com/',
+                                      'title': 'Synthetic',
+                                      'description': ''}}
+        self.calls = 0
+
+    def get(self, endpoint, blog_url=None, params=None):
+        self.calls += 1
+        params = params or {}
+        if endpoint == 'info':
+            return self.info
+        if endpoint == 'avatar':
+            return {'url': 'https://66.media.tumblr.com/avatar_512.png'}
+        if endpoint != 'posts':
+            raise ValueError('Unknown endpoint {}'.format(endpoint))
+        posts = self.posts
+        if 'id' in params:
+            posts = [p for p in posts if p['id'] == params['id']]
+        if 'before' in params:
+            posts = [p for p in posts if p['timestamp'] < params['before']]
+        offset = params.get('offset', 0)
+        posts = posts[offset:offset + params.get('limit', 20)]
+        if not params.get('notes_info'):
+            posts = [{k: v for k, v in p.items() if k != 'notes'}
+                     for p in posts]
+        return {'posts': posts, 'total_posts': len(self.posts)}
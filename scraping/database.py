@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection, transaction
+from threading import RLock
+import io
+
+# Applied to every new SQLite connection. WAL lets the admin read while a
+# scrape writes, and only syncs at checkpoints rather than every commit.
+# Override or add to them with the SQLITE_PRAGMAS setting.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # In KiB when negative, so 64 MiB
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 ** 2,
+    'temp_store': 'MEMORY',
+}
+# How many rows bulk_insert needs before it bypasses bulk_create. Fewer
+# aren't worth the setup.
+COPY_THRESHOLD = 1000
+# Held by the thread whose ingest block is writing to SQLite
+_write_lock = RLock()
+
+
+# Tunes new SQLite connections. Connected to the connection_created signal
+# in ScrapingConfig.ready.
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in sqlite_pragmas().items():
+            cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+
+
+def sqlite_pragmas():
+    return dict(SQLITE_PRAGMAS, **getattr(settings, 'SQLITE_PRAGMAS', {}))
+
+
+# Runs the with block in one transaction, tuned for a batch of writes that
+# can be redone if it's lost, e.g. a page of scraped posts. Each batch costs
+# one commit rather than one per row, and:
+# - On PostgreSQL, the commit doesn't wait for the WAL to be flushed
+#   (synchronous_commit off). A crash can lose the last few batches, but
+#   PostgreSQL documents that it can't corrupt the database.
+# - On SQLite, only one connection can write at a time, and a transaction
+#   that has read can't wait for its turn to write: it fails at once with
+#   'database is locked'. So the blocks of every thread in this process run
+#   one at a time, and threads writing alongside them should do it in
+#   blocks of their own. synchronous stays NORMAL, which in WAL mode only
+#   syncs at checkpoints; OFF is faster still, but SQLite documents that it
+#   can corrupt the database on a crash or power loss.
+@contextmanager
+def ingest():
+    if connection.vendor == 'sqlite':
+        with _write_lock, transaction.atomic():
+            yield
+        return
+    relax = (connection.vendor == 'postgresql' and
+             not connection.in_atomic_block)
+    with transaction.atomic():
+        if relax:
+            # Only lasts until the transaction ends
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL synchronous_commit TO OFF')
+        yield
+
+
+# Inserts many new instances of a model, like bulk_create. Large batches
+# skip building an INSERT statement for each few hundred rows: on PostgreSQL
+# they're streamed in with COPY, and elsewhere sent with executemany. Like
+# bulk_create on SQLite, none of these set the instances' ids.
+#   objs (list):
+#       the instances.
+def bulk_insert(model, objs):
+    objs = list(objs)
+    if len(objs) < COPY_THRESHOLD:
+        model.objects.bulk_create(objs, batch_size=500)
+    elif connection.vendor == 'postgresql':
+        copy(model, objs)
+    else:
+        insert_many(model, objs)
+
+
+# Returns the fields of a model that are inserted, i.e. all but the id.
+def insert_fields(model):
+    return [f for f in model._meta.concrete_fields if not f.primary_key]
+
+
+# Inserts instances of a model with one prepared INSERT run for every row.
+def insert_many(model, objs):
+    fields = insert_fields(model)
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(f.column) for f in fields),
+        ', '.join(['%s'] * len(fields)))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, True),
+                                                     connection)
+                                  for f in fields] for obj in objs])
+
+
+# Inserts instances of a model with PostgreSQL's COPY, a chunk at a time so
+# the data is never all in memory as text.
+#   chunk_size (int):
+#       the number of rows sent at a time.
+def copy(model, objs, chunk_size=10000):
+    fields = insert_fields(model)
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(f.column) for f in fields))
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(objs), chunk_size):
+            data = io.StringIO()
+            for obj in objs[i:i + chunk_size]:
+                data.write(','.join(
+                    csv_value(f.get_db_prep_save(f.pre_save(obj, True),
+                                                 connection))
+                    for f in fields))
+                data.write('\n')
+            data.seek(0)
+            # The raw cursor doesn't turn errors into Django's own, so
+            # IntegrityError can be caught as with bulk_create
+            with connection.wrap_database_errors:
+                cursor.cursor.copy_expert(sql, data)
+
+
+# Returns a value as a CSV field for COPY. Every value is quoted, so only
+# the unquoted \N is NULL and empty strings stay empty strings.
+def csv_value(value):
+    if value is None:
+        return '\\N'
+    return '"{}"'.format(str(value).replace('"', '""'))
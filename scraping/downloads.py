@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as tz
+from PIL import Image
+from scraping.adapters import pooled_adapter
+from scraping.models import Photo
+import hashlib
+import os
+import requests
+import tempfile
+
+
+# Keeps image files on local disk, named by the SHA-256 of their contents, so
+# each distinct image is only stored once however many urls it's at.
+#   directory (str):
+#       where to keep the files. Created if it doesn't exist.
+class PhotoStore(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    # Returns the path of the file with the given SHA-256.
+    def path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    # Stores a file from chunks of bytes as they arrive, without holding it
+    # all in memory. Returns its SHA-256 and size in bytes.
+    #   chunks (iterable):
+    #       the file's contents.
+    def put(self, chunks):
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            sha256 = digest.hexdigest()
+            path = self.path(sha256)
+            if os.path.exists(path):
+                # Already stored from another url
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return sha256, size
+
+
+# Returns the PhotoStore in the directory given by the PHOTO_STORE setting.
+def store():
+    return PhotoStore(settings.PHOTO_STORE)
+
+
+# Downloads photos' images into a PhotoStore with a pool of threads, and
+# records their hashes, sizes and dimensions. Only the calling thread uses
+# the database.
+#   store (PhotoStore):
+#       where to keep the images.
+#   workers (int):
+#       the number of images downloaded at once.
+#   throttle (RateLimiter):
+#       if given, waited on before each download.
+#   timeout (tuple):
+#       the connect and read timeouts in seconds.
+#   retries (int):
+#       the maximum number of times to retry a download.
+class Downloader(object):
+
+    def __init__(self, store, workers=8, throttle=None, timeout=(5, 60),
+                 retries=3):
+        self.store = store
+        self.workers = workers
+        self.throttle = throttle
+        self.session = requests.Session()
+        adapter = pooled_adapter(workers, timeout, retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # Downloads every photo that hasn't been downloaded yet, a chunk at a
+    # time. Each chunk is saved as soon as it's done, so an interrupted run
+    # carries on where it left off. Returns a dict with the number of
+    # photos 'downloaded' and 'failed'.
+    #   photos (QuerySet):
+    #       the photos to consider. Deleted photos are left out.
+    #   chunk_size (int):
+    #       the number of photos downloaded between saves.
+    #   limit (int):
+    #       if given, the maximum number of photos to try.
+    def run(self, photos, chunk_size=100, limit=None):
+        counts = {'downloaded': 0, 'failed': 0}
+        photos = photos.filter(sha256__isnull=True, deleted=False)
+        last_id = 0
+        with ThreadPoolExecutor(self.workers) as pool:
+            while limit is None or sum(counts.values()) < limit:
+                size = chunk_size
+                if limit is not None:
+                    size = min(size, limit - sum(counts.values()))
+                chunk = list(photos.filter(id__gt=last_id).order_by('id')
+                             .values_list('id', 'photo_url')[:size])
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                results = pool.map(self.fetch, [url for _, url in chunk])
+                with transaction.atomic():
+                    for (photo_id, url), result in zip(chunk, results):
+                        if result is None:
+                            counts['failed'] += 1
+                            continue
+                        Photo.objects.filter(id=photo_id).update(
+                            modified=tz.now(), **result)
+                        counts['downloaded'] += 1
+        return counts
+
+    # Downloads one image into the store. Returns a dict of the fields to
+    # set on its photo, or None if it couldn't be downloaded.
+    #   url (str):
+    #       the image's url.
+    def fetch(self, url):
+        if self.throttle:
+            self.throttle.wait(url)
+        try:
+            with self.session.get(url, stream=True) as response:
+                response.raise_for_status()
+                sha256, size = self.store.put(
+                    response.iter_content(chunk_size=64 * 1024))
+        except (requests.RequestException, OSError):
+            return None
+        width, height = self.dimensions(sha256)
+        return {'sha256': sha256, 'file_size': size, 'width': width,
+                'height': height}
+
+    # Returns the width and height of a stored image, or (None, None) if it
+    # isn't an image Pillow can read. Only the file's header is read.
+    def dimensions(self, sha256):
+        try:
+            with Image.open(self.store.path(sha256)) as image:
+                return image.size
+        except (OSError, SyntaxError):
+            return None, None
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from scraping.models import Photo
+import gzip
+import json
+import sys
+
+
+# Yields the lines of dump files in turn. Files ending in .gz are
+# decompressed as they're read.
+#   paths (list):
+#       the files' paths. - is standard input.
+def read_lines(paths):
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+            continue
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            yield from f
+
+
+# Turns lines of a dump, each a post from the Tumblr API as JSON, into photos
+# as Photo.from_tumblr_api returns them, without a source. Doesn't use the
+# database, so it can run in another process. Returns a tuple of a list of
+# (blog name, photos) tuples, one per photo post, and the number of lines
+# that weren't posts.
+#   lines (list):
+#       the lines. Blank ones are skipped.
+def parse(lines):
+    posts = []
+    bad = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            post = json.loads(line)
+            photos = Photo.from_tumblr_api(post, None)
+        except (ValueError, KeyError, TypeError):
+            bad += 1
+            continue
+        if photos:
+            posts.append((post.get('blog_name'), photos))
+    return posts, bad
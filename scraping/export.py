@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from scraping.models import Photo, WordAssociation
+from collections import defaultdict
+import csv
+import json
+
+# The columns of each exported photo, in order
+COLUMNS = ['id', 'source', 'post_url', 'photo_url', 'posted', 'title',
+           'caption', 'likes', 'note_count', 'rating', 'deleted', 'tags',
+           'words', 'ngrams']
+# The fields read for the columns that are the photo's own
+FIELDS = ['id', 'source__name', 'post_url', 'photo_url', 'posted', 'title',
+          'caption', 'likes', 'note_count', 'rating', 'deleted']
+
+
+# Yields lists of photos as dicts with COLUMNS as keys, a chunk at a time in
+# order of id. Each chunk takes four queries, for the photos, their tags,
+# their words and their ngrams, and only one chunk is in memory at a time.
+# 'tags' and 'ngrams' are lists of strings and 'words' maps each word to its
+# strength.
+#   photos (QuerySet):
+#       the photos to export.
+#   chunk_size (int):
+#       the number of photos in each chunk.
+def chunks(photos, chunk_size=1000):
+    last_id = 0
+    while True:
+        rows = list(photos.filter(id__gt=last_id).order_by('id')
+                    .values_list(*FIELDS)[:chunk_size])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        ids = [row[0] for row in rows]
+        tags = defaultdict(list)
+        for photo_id, tag_str in (Photo.tags.through.objects
+                                  .filter(photo_id__in=ids)
+                                  .values_list('photo_id', 'tag__tag_str')):
+            tags[photo_id].append(tag_str)
+        words = defaultdict(dict)
+        for photo_id, word_str, strength in (
+                WordAssociation.objects.filter(photo_id__in=ids)
+                .values_list('photo_id', 'word__word_str', 'strength')):
+            words[photo_id][word_str] = strength
+        ngrams = defaultdict(list)
+        for photo_id, expression in (Photo.ngrams.through.objects
+                                     .filter(photo_id__in=ids)
+                                     .values_list('photo_id',
+                                                  'ngram__expression')):
+            ngrams[photo_id].append(expression)
+        yield [dict(zip(COLUMNS, row),
+                    tags=sorted(tags[row[0]]),
+                    words=dict(sorted(words[row[0]].items())),
+                    ngrams=sorted(ngrams[row[0]]))
+               for row in rows]
+
+
+# Writes photos as JSON, one per line.
+#   f (file):
+#       a text file open for writing.
+class JsonlWriter(object):
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, photos):
+        for photo in photos:
+            photo = dict(photo, posted=photo['posted'] and
+                         photo['posted'].isoformat())
+            self.f.write(json.dumps(photo) + '\n')
+
+    def close(self):
+        pass
+
+
+# Writes photos as CSV with a header row. The tags, words and ngrams columns
+# hold JSON.
+#   f (file):
+#       a text file open for writing, with newline=''.
+class CsvWriter(object):
+
+    def __init__(self, f):
+        self.writer = csv.DictWriter(f, COLUMNS)
+        self.writer.writeheader()
+
+    def write(self, photos):
+        for photo in photos:
+            self.writer.writerow(dict(
+                photo, posted=photo['posted'] and photo['posted'].isoformat(),
+                tags=json.dumps(photo['tags']),
+                words=json.dumps(photo['words']),
+                ngrams=json.dumps(photo['ngrams'])))
+
+    def close(self):
+        pass
+
+
+# Writes photos to a Parquet file, a row group per call to write. Words are
+# a list of {'word', 'strength'} structs. Needs pyarrow.
+#   f (file or str):
+#       a binary file open for writing, or a path.
+class ParquetWriter(object):
+
+    def __init__(self, f):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([
+            ('id', pa.int64()),
+            ('source', pa.string()),
+            ('post_url', pa.string()),
+            ('photo_url', pa.string()),
+            ('posted', pa.timestamp('us', tz='UTC')),
+            ('title', pa.string()),
+            ('caption', pa.string()),
+            ('likes', pa.int64()),
+            ('note_count', pa.int64()),
+            ('rating', pa.int64()),
+            ('deleted', pa.bool_()),
+            ('tags', pa.list_(pa.string())),
+            ('words', pa.list_(pa.struct([('word', pa.string()),
+                                          ('strength', pa.int64())]))),
+            ('ngrams', pa.list_(pa.string())),
+        ])
+        self.writer = pq.ParquetWriter(f, self.schema)
+
+    def write(self, photos):
+        columns = {c: [photo[c] for photo in photos] for c in COLUMNS}
+        columns['words'] = [[{'word': w, 'strength': s}
+                             for w, s in words.items()]
+                            for words in columns['words']]
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(columns[c], type=self.schema.field(c).type)
+             for c in COLUMNS], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+# The writer for each format, and whether it writes bytes
+WRITERS = {
+    'jsonl': (JsonlWriter, False),
+    'csv': (CsvWriter, False),
+    'parquet': (ParquetWriter, True),
+}
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# What the cache does on each call:
+#   'off': nothing; every call goes to the network
+#   'cache': serves stored responses younger than the ttl, fetching and
+#       storing the rest
+#   'record': always fetches, storing every response
+#   'replay': only serves stored responses, whatever their age. Calls with
+#       no stored response raise CacheMiss instead of using the network.
+MODES = ('off', 'cache', 'record', 'replay')
+
+
+class CacheMiss(Exception):
+    pass
+
+
+# Stores API responses as JSON files on local disk, keyed by the endpoint,
+# blog and parameters of the call. When the files take up more than max_size
+# bytes, the least recently used are deleted.
+#   directory (str):
+#       where to keep the files. Created if it doesn't exist.
+#   mode (str):
+#       one of MODES.
+#   ttl (float):
+#       how long responses are served for in 'cache' mode, in seconds. None
+#       to serve them forever.
+#   max_size (int):
+#       the maximum total size of the files, in bytes. None for no limit.
+class ResponseCache(object):
+
+    def __init__(self, directory, mode='cache', ttl=24 * 60 * 60,
+                 max_size=1024 ** 3):
+        if mode not in MODES:
+            raise ValueError('mode must be one of {}'.format(', '.join(MODES)))
+        self.directory = directory
+        self.mode = mode
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = Lock()
+        # Total size of the files, worked out on the first store
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    # Returns the response to a call, from disk if possible.
+    #   fetch (callable):
+    #       makes the call and returns the response. Must be JSON
+    #       serializable.
+    def get(self, fetch, endpoint, blog_url=None, params=None):
+        if self.mode == 'off':
+            return fetch()
+        path = self.path(endpoint, blog_url, params)
+        if self.mode != 'record':
+            response = self.load(path)
+            if response is not None:
+                return response
+            if self.mode == 'replay':
+                raise CacheMiss('No recorded response for {} {} {}'.format(
+                    endpoint, blog_url, params))
+        response = fetch()
+        self.store(path, response)
+        return response
+
+    # Returns the path of the file for a call.
+    def path(self, endpoint, blog_url=None, params=None):
+        key = json.dumps([endpoint, blog_url, params or {}], sort_keys=True)
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.json')
+
+    # Stores the response to a call directly, e.g. to build fixtures.
+    def put(self, response, endpoint, blog_url=None, params=None):
+        self.store(self.path(endpoint, blog_url, params), response)
+
+    # Returns the response stored at path, or None if there isn't one or it's
+    # too old to serve.
+    def load(self, path):
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if (self.mode != 'replay' and self.ttl is not None and
+                    age > self.ttl):
+                return None
+            with open(path, encoding='utf-8') as f:
+                response = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Mark it as recently used
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+        return response
+
+    def store(self, path, response):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see half a file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(response, f)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        if self.max_size is None:
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._files())
+            else:
+                self._size += size
+            full = self._size > self.max_size
+        if full:
+            self.evict()
+
+    # Deletes the least recently used files until the total size is under
+    # max_size.
+    def evict(self):
+        with self._lock:
+            files = self._files()
+            self._size = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if self._size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    self._size -= size
+                except OSError:
+                    pass
+
+    # Returns a list of (last used time, size, path) tuples for the files.
+    def _files(self):
+        files = []
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_atime, stat.st_size, path))
+        return files
+
+    # Deletes every stored response.
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._files():
+                os.remove(path)
+            self._size = 0
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from threading import local
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+import time
+
+_local = local()
+# Callables given every finished Profile, as well as those named in the
+# SCRAPING_PROFILE_HOOKS setting
+_hooks = []
+
+
+# Wall time, call counts and SQL query counts for each stage of the work done
+# for one source. Stages can be nested, and a stage's numbers include those of
+# the stages inside it.
+#   name (str):
+#       what's being profiled, usually the source's name.
+class Profile(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = OrderedDict()
+
+    # Records one call to a stage.
+    def add(self, stage, seconds, queries):
+        totals = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0,
+                                                'queries': 0})
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        totals['queries'] += queries
+
+    # Adds another profile's numbers to this one's.
+    def merge(self, other):
+        for stage, totals in other.stages.items():
+            mine = self.stages.setdefault(stage, {'calls': 0, 'seconds': 0,
+                                                  'queries': 0})
+            for key, value in totals.items():
+                mine[key] += value
+
+    def as_dict(self):
+        return {'name': self.name, 'stages': self.stages}
+
+    # Returns the stages as lines of a table.
+    def table(self):
+        lines = ['{:20} {:>8} {:>10} {:>8}'.format(
+            'Stage', 'Calls', 'Seconds', 'Queries')]
+        for stage, totals in self.stages.items():
+            lines.append('{:20.20} {:>8} {:>10.3f} {:>8}'.format(
+                stage, totals['calls'], totals['seconds'], totals['queries']))
+        return lines
+
+
+# Adds a callable to be given every finished Profile, e.g. to send it to a
+# metrics system.
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+# Returns the Profile being recorded in this thread, or None.
+def current():
+    return getattr(_local, 'profile', None)
+
+
+# Records stages run in this thread, in the with block, in a new Profile.
+# Yields the profile, and passes it to the hooks when the block ends.
+#   name (str):
+#       the profile's name, usually the source's name.
+@contextmanager
+def profiling(name):
+    profile = Profile(name)
+    old_profile = current()
+    _local.profile = profile
+    # Queries are only logged, and so can only be counted, with a debug
+    # cursor
+    old_force_debug_cursor = connection.force_debug_cursor
+    connection.force_debug_cursor = True
+    try:
+        yield profile
+    finally:
+        connection.force_debug_cursor = old_force_debug_cursor
+        _local.profile = old_profile
+    for hook in _hooks + [import_string(h) for h in
+                          getattr(settings, 'SCRAPING_PROFILE_HOOKS', [])]:
+        hook(profile)
+
+
+# Times the with block and counts its queries as a call to a stage. Does
+# nothing if no profile is being recorded.
+#   name (str):
+#       the stage's name.
+#   profile (Profile):
+#       the profile to record in. Defaults to the one being recorded in this
+#       thread; pass one explicitly from other threads.
+@contextmanager
+def stage(name, profile=None):
+    profile = profile or current()
+    if profile is None:
+        yield
+        return
+    queries = query_count()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start,
+                    query_count() - queries)
+
+
+# Decorates a function so each call is recorded as a stage.
+def profiled(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# A query log that counts every query added to it. Django's log only keeps the
+# most recent queries, so its length can't be used as a count.
+class _CountingLog(deque):
+
+    count = 0
+
+    def append(self, item):
+        self.count += 1
+        super().append(item)
+
+
+# Returns the number of queries this thread's connection has logged.
+def query_count():
+    log = connection.queries_log
+    if not isinstance(log, _CountingLog):
+        log = _CountingLog(log, maxlen=log.maxlen)
+        connection.queries_log = log
+    return log.count
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone as tz
+from scraping.models import *
+from scraping import schema
+from collections import OrderedDict
+from datetime import timedelta
+import json
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = ("Compares query plans and timings with and without the "
+            "association and photo indexes, on a throwaway database of "
+            "synthetic rows")
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--photos', type=int, default=100000)
+        parser.add_argument('-w', '--words-per-photo', type=int, default=20)
+        parser.add_argument('--words', type=int, default=5000)
+        parser.add_argument('-n', '--ngrams', type=int, default=200000)
+        parser.add_argument('-s', '--sources', type=int, default=20)
+        # Number of times each query is run
+        parser.add_argument('-r', '--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        # Where to write the results as JSON
+        parser.add_argument('-o', '--output', type=str)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        # Never touch the real database
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            # Start from the tables as they were before the indexes, which is
+            # quick while they're empty
+            schema.remove_indexes()
+            start = time.monotonic()
+            self.fill(options)
+            print('Made synthetic rows in {:.1f} seconds'.format(
+                time.monotonic() - start))
+            results = OrderedDict()
+            results['before'] = self.measure(options['repeat'])
+            start = time.monotonic()
+            schema.add_indexes()
+            results['add_indexes_seconds'] = time.monotonic() - start
+            results['after'] = self.measure(options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        results['config'] = {k: options[k] for k in
+                             ['photos', 'words_per_photo', 'words', 'ngrams',
+                              'sources', 'repeat', 'seed']}
+        self.print_results(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            print('Wrote results to {}'.format(options['output']))
+
+    # Inserts the synthetic rows with plain SQL, a batch at a time.
+    def fill(self, options):
+        now = tz.now()
+        with transaction.atomic():
+            for i in range(options['sources']):
+                Source.objects.create(url='http://source{}.tumblr.com/'
+                                      .format(i), name='Source {}'.format(i))
+            source_ids = list(Source.objects.values_list('id', flat=True))
+            Word.objects.bulk_create([Word(word_str='word{}'.format(i))
+                                      for i in range(options['words'])])
+            word_ids = list(Word.objects.values_list('id', flat=True))
+            self.insert(Photo, ['source_id', 'photo_url', 'posted'],
+                        ((self.random.choice(source_ids),
+                          'http://example.com/{}.jpg'.format(i),
+                          now - timedelta(minutes=i))
+                         for i in range(options['photos'])),
+                        defaults=True)
+            photo_ids = list(Photo.objects.values_list('id', flat=True))
+            self.insert(WordAssociation, ['photo_id', 'word_id', 'strength'],
+                        ((photo_id, word_id, 1)
+                         for photo_id in photo_ids
+                         for word_id in self.random.sample(
+                             word_ids, options['words_per_photo'])))
+            self.insert(Ngram, ['expression'],
+                        (('word{} word{}'.format(i, i + 1),)
+                         for i in range(options['ngrams'])))
+            ngram_ids = list(Ngram.objects.values_list('id', flat=True))
+            self.insert(NgramAssociation, ['ngram_id', 'word_id', 'order'],
+                        ((ngram_id, self.random.choice(word_ids), order)
+                         for ngram_id in ngram_ids for order in range(2)))
+
+    # Inserts rows into a model's table.
+    #   columns (list):
+    #       the columns given for each row.
+    #   rows (iterable):
+    #       tuples of the values of the columns.
+    #   defaults (bool):
+    #       whether to fill the model's other columns with their defaults.
+    def insert(self, model, columns, rows, defaults=False):
+        extra = {}
+        if defaults:
+            for f in model._meta.concrete_fields:
+                if f.column in columns or f.primary_key:
+                    continue
+                # auto_now fields have no default, as they're set on save
+                value = (tz.now() if getattr(f, 'auto_now', False)
+                         else f.get_default())
+                extra[f.column] = f.get_db_prep_save(value, connection)
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(c)
+                      for c in columns + list(extra)),
+            ', '.join(['%s'] * (len(columns) + len(extra))))
+        field_for = {f.column: f for f in model._meta.concrete_fields}
+        batch = []
+        with connection.cursor() as cursor:
+            for row in rows:
+                batch.append([field_for[c].get_db_prep_save(v, connection)
+                              for c, v in zip(columns, row)] +
+                             list(extra.values()))
+                if len(batch) == 10000:
+                    cursor.executemany(sql, batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+
+    # Returns the query plan and mean time in milliseconds of each query.
+    def measure(self, repeat):
+        photo_ids = list(Photo.objects.values_list('id', flat=True)[:1000])
+        source_ids = list(Source.objects.values_list('id', flat=True))
+        max_ngram = Ngram.objects.order_by('-id').values_list('id',
+                                                              flat=True)[0]
+        max_word = Word.objects.order_by('-id').values_list('id',
+                                                            flat=True)[0]
+        queries = OrderedDict([
+            # The association of one photo and word, as an upsert checks
+            ('photo word', lambda: WordAssociation.objects.filter(
+                photo_id=self.random.choice(photo_ids),
+                word_id=self.random.randint(1, max_word))
+             .values_list('id', 'strength')),
+            # The words of ngrams in order, as dedupe_ngrams reads them
+            ('ngram words', lambda: NgramAssociation.objects.filter(
+                ngram_id__in=[self.random.randint(1, max_ngram)
+                              for _ in range(50)])
+             .order_by('ngram_id', 'order').values_list('ngram_id',
+                                                       'word_id')),
+            # A source's newest photos, as refresh_likes reads them
+            ('source photos', lambda: Photo.objects.filter(
+                source_id=self.random.choice(source_ids))
+             .order_by('-posted').values_list('id', 'post_url')[:500]),
+            ('ngram expression', lambda: Ngram.objects.filter(
+                expression='word{} word{}'.format(
+                    *[self.random.randint(1, max_ngram)] * 2))
+             .values_list('id', flat=True)),
+        ])
+        results = OrderedDict()
+        for name, make_query in queries.items():
+            results[name] = {'plan': self.plan(make_query())}
+            start = time.perf_counter()
+            for _ in range(repeat):
+                list(make_query())
+            results[name]['milliseconds'] = ((time.perf_counter() - start) /
+                                             repeat * 1000)
+        return results
+
+    # Returns the database's plan for a query, as a list of lines.
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        explain = ('EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite'
+                   else 'EXPLAIN ')
+        with connection.cursor() as cursor:
+            cursor.execute(explain + sql, params)
+            return [' '.join(str(c) for c in row) for row in cursor.fetchall()]
+
+    def print_results(self, results):
+        print('{:18} {:>12} {:>12}'.format('Query', 'Before (ms)',
+                                           'After (ms)'))
+        for name in results['before']:
+            print('{:18} {:>12.3f} {:>12.3f}'.format(
+                name, results['before'][name]['milliseconds'],
+                results['after'][name]['milliseconds']))
+        print('\nAdding the indexes took {:.1f} seconds'.format(
+            results['add_indexes_seconds']))
+        for stage in ['before', 'after']:
+            print('\nPlans {}:'.format(stage))
+            for name, result in results[stage].items():
+                print('  ' + name)
+                for line in result['plan']:
+                    print('    ' + line)
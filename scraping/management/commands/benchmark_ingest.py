@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone as tz
+from scraping.models import *
+from scraping import instrumentation, tumblr, vocabulary
+from scraping.benchmarks.synthetic import make_posts, StandInClient
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import time
+import tracemalloc
+
+
+class Command(BaseCommand):
+    help = ("Measures ingest throughput on synthetic posts, in a throwaway "
+            "database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--posts', type=int, default=200)
+        parser.add_argument('--caption-words', type=int, default=12)
+        parser.add_argument('--tags', type=int, default=5)
+        parser.add_argument('--photos-per-post', type=int, default=1)
+        parser.add_argument('--notes', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        # Where to write the results as JSON
+        parser.add_argument('-o', '--output', type=str)
+
+    def handle(self, *args, **options):
+        posts = make_posts(options['posts'],
+                           caption_words=options['caption_words'],
+                           tags=options['tags'],
+                           photos=options['photos_per_post'],
+                           notes=options['notes'],
+                           seed=options['seed'])
+        # Never touch the real database
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        old_client = tumblr.set_client(StandInClient(posts))
+        try:
+            vocabulary.clear()
+            with instrumentation.profiling('benchmark') as profile:
+                results = self.run(posts)
+            # Detailed numbers for every instrumented stage
+            results['profile'] = profile.stages
+        finally:
+            tumblr.set_client(old_client)
+            vocabulary.clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        results['config'] = {k: options[k] for k in
+                             ['posts', 'caption_words', 'tags',
+                              'photos_per_post', 'notes', 'seed']}
+        results['time'] = tz.now().isoformat()
+        self.print_results(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            print('Wrote results to {}'.format(options['output']))
+
+    # Runs each stage of ingestion over the posts and returns the results.
+    def run(self, posts):
+        stages = OrderedDict()
+        blog = TumblrBlog(url='http://synthetic.tumblr.com/',
+                          name='Synthetic')
+        blog.save()
+        tracemalloc.start()
+        start = time.perf_counter()
+        # Pagination, from_tumblr_api and saving photos and tags
+        with self.stage(stages, 'scrape'):
+            blog.scrape(all=True)
+        photos = list(Photo.objects.filter(source=blog))
+        with self.stage(stages, 'get_words'):
+            for photo in photos:
+                photo.get_words()
+        with self.stage(stages, 'make_ngrams'):
+            for photo in photos:
+                photo.make_ngrams()
+        total = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        queries = sum(s['queries'] for s in stages.values())
+        return {'photos': len(photos),
+                'seconds': total,
+                'posts_per_second': len(posts) / total,
+                'queries_per_photo': queries / max(len(photos), 1),
+                'peak_memory_bytes': peak_memory,
+                'stages': stages}
+
+    # Times the code in a with block and counts its queries, storing them
+    # in stages under name.
+    @contextmanager
+    def stage(self, stages, name):
+        queries = instrumentation.query_count()
+        start = time.perf_counter()
+        yield
+        stages[name] = {'seconds': time.perf_counter() - start,
+                        'queries': instrumentation.query_count() - queries}
+
+    def print_results(self, results):
+        print('{:12} {:>10} {:>10}'.format('Stage', 'Seconds', 'Queries'))
+        for name, stage in results['stages'].items():
+            print('{:12} {:>10.3f} {:>10}'.format(name, stage['seconds'],
+                                                  stage['queries']))
+        print()
+        print('Photos:\t\t\t{}'.format(results['photos']))
+        print('Posts/second:\t\t{:.1f}'.format(results['posts_per_second']))
+        print('Queries/photo:\t\t{:.1f}'.format(results['queries_per_photo']))
+        print('Peak memory:\t\t{:.1f} MB'.format(
+            results['peak_memory_bytes'] / 1024 ** 2))
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from scraping.benchmarks import startup
+import statistics
+
+
+class Command(BaseCommand):
+    help = ("Measures how long it takes to set up Django and import the "
+            "scraping app, and which slow modules it imports")
+
+    def add_arguments(self, parser):
+        parser.add_argument('-r', '--runs', type=int, default=10)
+        parser.add_argument('-m', '--modules', nargs="+", type=str,
+                            default=['scraping.models', 'scraping.admin'])
+
+    def handle(self, *args, **options):
+        results = startup.measure(options['modules'], options['runs'])
+        seconds = results['seconds']
+        print('Median:\t\t{:.3f} s'.format(statistics.median(seconds)))
+        print('Fastest:\t{:.3f} s'.format(min(seconds)))
+        print('Slowest:\t{:.3f} s'.format(max(seconds)))
+        print('Slow imports:\t{}'.format(', '.join(results['heavy']) or
+                                          'none'))
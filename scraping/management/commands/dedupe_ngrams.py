@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from scraping.models import *
+from collections import defaultdict
+
+
+class Command(BaseCommand):
+    help = ("Gives digests to ngrams stored without them, merging ngrams "
+            "with the same words into one")
+
+    def add_arguments(self, parser):
+        parser.add_argument('-c', '--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        last_id = 0
+        merged = 0
+        kept = 0
+        while True:
+            # Work through the ngrams without digests in chunks, so they never
+            # all have to be in memory at once
+            chunk = list(Ngram.objects.filter(id__gt=last_id,
+                                              digest__isnull=True)
+                         .order_by('id')
+                         .values_list('id', flat=True)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_id = chunk[-1]
+            with transaction.atomic():
+                chunk_merged = self.dedupe_chunk(chunk)
+            merged += chunk_merged
+            kept += len(chunk) - chunk_merged
+            print('Checked {} ngrams, merged {}'.format(merged + kept, merged))
+        print('Done. Kept {} ngrams and merged {} duplicates.'.format(kept,
+                                                                      merged))
+
+    # Gives each ngram in the chunk a digest, or merges it into the ngram that
+    # already has that digest. Returns the number of ngrams merged.
+    def dedupe_chunk(self, chunk):
+        # Rebuild the expressions from the words, in case the stored ones
+        # were never updated
+        word_strs = defaultdict(list)
+        for ngram_id, word_str in (NgramAssociation.objects
+                                   .filter(ngram_id__in=chunk)
+                                   .order_by('ngram_id', 'order')
+                                   .values_list('ngram_id', 'word__word_str')):
+            word_strs[ngram_id].append(word_str)
+        digests = {n: Ngram.make_digest(' '.join(word_strs[n])) for n in chunk}
+        # The ngram each digest belongs to
+        owners = dict(Ngram.objects.filter(digest__in=set(digests.values()))
+                      .values_list('digest', 'id'))
+        # Maps duplicate ngrams to the ngram they're merged into
+        duplicates = {}
+        for ngram_id in chunk:
+            digest = digests[ngram_id]
+            if digest in owners:
+                duplicates[ngram_id] = owners[digest]
+            else:
+                owners[digest] = ngram_id
+                Ngram.objects.filter(id=ngram_id).update(
+                    digest=digest, expression=' '.join(word_strs[ngram_id]))
+        if duplicates:
+            self.merge(duplicates)
+        return len(duplicates)
+
+    # Moves photos from duplicate ngrams to the ngrams they duplicate and
+    # deletes the duplicates.
+    #   duplicates (dict):
+    #       maps each duplicate ngram's id to the id of the ngram to keep.
+    def merge(self, duplicates):
+        through = Photo.ngrams.through
+        # Photos already linked to the ngrams being kept
+        linked = set(through.objects.filter(
+            ngram_id__in=set(duplicates.values()))
+                     .values_list('photo_id', 'ngram_id'))
+        to_delete = []
+        to_move = defaultdict(list)
+        for link_id, photo_id, ngram_id in (through.objects
+                                            .filter(ngram_id__in=duplicates)
+                                            .values_list('id', 'photo_id',
+                                                         'ngram_id')):
+            keep = duplicates[ngram_id]
+            # The photo is already linked to the kept ngram, so drop the link
+            if (photo_id, keep) in linked:
+                to_delete.append(link_id)
+            else:
+                linked.add((photo_id, keep))
+                to_move[keep].append(link_id)
+        # Links are changed in slices to stay under SQLite's parameter limit
+        for i in range(0, len(to_delete), 500):
+            through.objects.filter(id__in=to_delete[i:i + 500]).delete()
+        for keep, link_ids in to_move.items():
+            for i in range(0, len(link_ids), 500):
+                through.objects.filter(id__in=link_ids[i:i + 500]).update(
+                    ngram_id=keep)
+        NgramAssociation.objects.filter(ngram_id__in=duplicates).delete()
+        Ngram.objects.filter(id__in=duplicates).delete()
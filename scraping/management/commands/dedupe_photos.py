@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone as tz
+from scraping.models import *
+from scraping import downloads, phash
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+
+class Command(BaseCommand):
+    help = ("Hashes downloaded images and marks all but one photo of each "
+            "group of near-duplicates deleted")
+
+    def add_arguments(self, parser):
+        # Images whose hashes differ in at most this many bits are
+        # near-duplicates
+        parser.add_argument('-k', '--distance', type=int, default=4)
+        # Number of processes hashing images. Defaults to one per core.
+        parser.add_argument('-w', '--workers', type=int)
+        parser.add_argument('-c', '--chunk-size', type=int, default=1000)
+        # Only print the groups of near-duplicates
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        hashed = self.hash_images(options['workers'], options['chunk_size'])
+        print('Hashed {} images'.format(hashed))
+        groups = self.find_groups(options['distance'])
+        print('Found {} groups of near-duplicates'.format(len(groups)))
+        deleted = 0
+        for keep, duplicates in groups:
+            print('Keeping {}, deleting {}'.format(
+                keep, ', '.join(str(d) for d in duplicates)))
+            deleted += len(duplicates)
+        if not options['dry_run']:
+            with transaction.atomic():
+                for _, duplicates in groups:
+                    Photo.objects.filter(id__in=duplicates).update(
+                        deleted=True, modified=tz.now())
+                Source.update_stats()
+            print('Marked {} photos deleted'.format(deleted))
+
+    # Works out the hashes of downloaded images that haven't been hashed, in a
+    # pool of processes. Photos with the same image share one hash. Returns
+    # the number of images hashed.
+    def hash_images(self, workers, chunk_size):
+        store = downloads.store()
+        photos = Photo.objects.filter(sha256__isnull=False, phash__isnull=True)
+        hashed = 0
+        last_sha256 = ''
+        with ProcessPoolExecutor(workers) as pool:
+            while True:
+                # Work through the images in chunks, so they never all have
+                # to be in memory at once
+                chunk = list(photos.filter(sha256__gt=last_sha256)
+                             .order_by('sha256')
+                             .values_list('sha256', flat=True)
+                             .distinct()[:chunk_size])
+                if not chunk:
+                    break
+                last_sha256 = chunk[-1]
+                hashes = pool.map(phash.image_hash,
+                                  [store.path(s) for s in chunk],
+                                  chunksize=max(1, len(chunk) // 64))
+                with transaction.atomic():
+                    for sha256, hash in zip(chunk, hashes):
+                        if hash is None:
+                            continue
+                        photos.filter(sha256=sha256).update(
+                            phash=phash.to_hex(hash))
+                        hashed += 1
+        return hashed
+
+    # Returns a list of (photo_id, duplicate_ids) tuples, one for each group
+    # of photos whose images are near-duplicates. Photos are taken best first,
+    # the best being the one with the largest image, then the most likes, then
+    # the oldest, and each one not already in a group is kept, with the photos
+    # within max_distance of it as its duplicates. So every duplicate is near
+    # the photo kept, not just near another duplicate.
+    def find_groups(self, max_distance):
+        tree = phash.BKTree()
+        photos = []
+        for photo_id, hex_hash, width, height, likes, posted in (
+                Photo.objects.filter(phash__isnull=False, deleted=False)
+                .values_list('id', 'phash', 'width', 'height', 'likes',
+                             'posted')):
+            hash = phash.from_hex(hex_hash)
+            tree.add(hash, photo_id)
+            # Photos without a posted date count as the newest
+            photos.append(((-(width or 0) * (height or 0), -(likes or 0),
+                            posted is None, posted and posted.timestamp(),
+                            photo_id), photo_id, hash))
+        photos.sort()
+        grouped = set()
+        results = []
+        for _, photo_id, hash in photos:
+            if photo_id in grouped:
+                continue
+            grouped.add(photo_id)
+            duplicates = sorted(other_id for _, other_id
+                                in tree.find(hash, max_distance)
+                                if other_id not in grouped)
+            grouped.update(duplicates)
+            if duplicates:
+                results.append((photo_id, duplicates))
+        return sorted(results)
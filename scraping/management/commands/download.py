@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from scraping.models import *
+from scraping import downloads
+from scraping.throttle import RateLimiter
+import time
+
+
+class Command(BaseCommand):
+    help = "Downloads the images of photos that haven't been downloaded yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--source', nargs="+", type=str)
+        # Number of images to download at once
+        parser.add_argument('-w', '--workers', type=int, default=8)
+        # Maximum downloads per second, overall and from any one host
+        parser.add_argument('--rate', type=float)
+        parser.add_argument('--host-rate', type=float)
+        # Maximum number of photos to try
+        parser.add_argument('-l', '--limit', type=int)
+        parser.add_argument('-c', '--chunk-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.all()
+        if options['source']:
+            photos = photos.filter(source__name__in=options['source'])
+        downloader = downloads.Downloader(
+            downloads.store(), workers=options['workers'],
+            throttle=RateLimiter(options['rate'], options['host_rate']))
+        start = time.monotonic()
+        counts = downloader.run(photos, chunk_size=options['chunk_size'],
+                                limit=options['limit'])
+        print('Downloaded {} photos in {:.1f} seconds, {} failed'.format(
+            counts['downloaded'], time.monotonic() - start, counts['failed']))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone as tz
+from scraping.models import *
+from scraping import export
+from datetime import datetime as dt
+import os
+import sys
+import time
+
+
+class Command(BaseCommand):
+    help = ("Exports photos with their tags, words and ngrams as JSON lines, "
+            "CSV or Parquet, a chunk at a time")
+
+    def add_arguments(self, parser):
+        # The file to write, or - for standard output
+        parser.add_argument('output', type=str)
+        # Guessed from the output's extension if not given
+        parser.add_argument('-f', '--format', choices=sorted(export.WRITERS))
+        parser.add_argument('-s', '--source', nargs="+", type=str)
+        # Only photos posted on or after this date, e.g. 2016-07-22
+        parser.add_argument('--since', type=str)
+        parser.add_argument('--exclude-deleted', action='store_true')
+        # Number of photos read and written at a time
+        parser.add_argument('-c', '--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.all()
+        if options['source']:
+            photos = photos.filter(source__name__in=options['source'])
+        if options['since']:
+            since = tz.make_aware(dt.strptime(options['since'], '%Y-%m-%d'))
+            photos = photos.filter(posted__gte=since)
+        if options['exclude_deleted']:
+            photos = photos.filter(deleted=False)
+        output = options['output']
+        format = options['format']
+        if format is None:
+            format = os.path.splitext(output)[1].lstrip('.').lower()
+            format = {'json': 'jsonl', 'ndjson': 'jsonl'}.get(format, format)
+            if format not in export.WRITERS:
+                raise CommandError("Can't tell the format of {}; give it "
+                                   "with --format".format(output))
+        writer_class, binary = export.WRITERS[format]
+        if output == '-':
+            f = sys.stdout.buffer if binary else sys.stdout
+        else:
+            f = open(output, 'wb' if binary else 'w',
+                     **({} if binary else {'newline': '', 'encoding': 'utf-8'}))
+        try:
+            try:
+                writer = writer_class(f)
+            except ImportError as e:
+                raise CommandError('Writing {} needs {}'.format(format,
+                                                                e.name))
+            start = time.monotonic()
+            done = 0
+            for chunk in export.chunks(photos, options['chunk_size']):
+                writer.write(chunk)
+                done += len(chunk)
+                # Progress goes to standard error, as the export may be
+                # going to standard output
+                print('Exported {} photos ({:.0f} per second)'.format(
+                    done, done / (time.monotonic() - start)),
+                    file=sys.stderr)
+            writer.close()
+        finally:
+            if output != '-':
+                f.close()
+        print('Done. Exported {} photos.'.format(done), file=sys.stderr)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand, CommandError
+from scraping.models import *
+from scraping import database, dumps, pipeline
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+# The urls a blog may have been added with, the first of which is given to
+# blogs first seen in a dump
+BLOG_URLS = ['http://{}.tumblr.com/', 'https://{}.tumblr.com/']
+
+
+class Command(BaseCommand):
+    help = ("Saves the photos in dumps of posts from the Tumblr API, one JSON "
+            "post per line, parsing them in a pool of processes. Photos "
+            "already saved are updated or skipped, so a dump can be "
+            "ingested again safely")
+
+    def add_arguments(self, parser):
+        # Files of posts. - or none reads standard input. Files ending in .gz
+        # are decompressed.
+        parser.add_argument('path', nargs='*', default=['-'])
+        # Save every photo to the source with this name, rather than to the
+        # blog each post names, which is added if it's new
+        parser.add_argument('-s', '--source', type=str)
+        # Number of processes. 1 does everything in this one.
+        parser.add_argument('-w', '--workers', type=int,
+                            default=os.cpu_count())
+        # Number of lines handed to a process, and saved, at a time
+        parser.add_argument('-b', '--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        source = None
+        if options['source']:
+            try:
+                source = Source.objects.get(name=options['source'])
+            except Source.DoesNotExist:
+                raise CommandError('No source named {}'.format(
+                    options['source']))
+        self.sources = {}
+        pool = None
+        if options['workers'] > 1:
+            pool = ProcessPoolExecutor(options['workers'])
+        # Batches parsed ahead of the one being saved. Bounded, so a dump is
+        # never all in memory.
+        ahead = 2 * options['workers']
+        self.counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        self.bad = 0
+        self.start = time.monotonic()
+        pending = deque()
+        try:
+            for lines in pipeline.batched(dumps.read_lines(options['path']),
+                                          options['batch_size']):
+                pending.append(pool.submit(dumps.parse, lines) if pool
+                               else dumps.parse(lines))
+                if len(pending) > ahead:
+                    self.save(pending.popleft(), source)
+            while pending:
+                self.save(pending.popleft(), source)
+        finally:
+            if pool:
+                pool.shutdown()
+        print('Done. Inserted {inserted}, updated {updated} and skipped '
+              '{skipped} photos.'.format(**self.counts))
+        if self.bad:
+            print('{} lines were not photo posts that could be read'
+                  .format(self.bad))
+        if self.counts['inserted'] or self.counts['updated']:
+            print('Run reindex to work out their words and ngrams')
+
+    # Waits for a batch to be parsed and saves its photos in one transaction.
+    #   parsed (tuple or Future):
+    #       the result of dumps.parse.
+    #   source (Source):
+    #       if given, the source of every photo.
+    def save(self, parsed, source):
+        posts, bad = parsed if isinstance(parsed, tuple) else parsed.result()
+        self.bad += bad
+        photos = []
+        for blog_name, post_photos in posts:
+            post_source = source or self.blog(blog_name)
+            if post_source is None:
+                self.bad += 1
+                continue
+            for photo_data in post_photos:
+                photo_data['photo'].source = post_source
+            photos += post_photos
+        with database.ingest():
+            for key, count in TumblrBlog.save_photos(photos).items():
+                self.counts[key] += count
+        done = sum(self.counts.values())
+        print('Ingested {} photos ({:.0f} per second)'.format(
+            done, done / (time.monotonic() - self.start)))
+
+    # Returns the TumblrBlog with the given name, adding it if it's new, or
+    # None if there's no name.
+    def blog(self, name):
+        if not name:
+            return None
+        if name not in self.sources:
+            urls = [url.format(name) for url in BLOG_URLS]
+            blog = TumblrBlog.objects.filter(url__in=urls).first()
+            if blog is None:
+                blog = TumblrBlog.objects.create(url=urls[0], name=name)
+            self.sources[name] = blog
+        return self.sources[name]
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from scraping.models import *
+
+
+class Command(BaseCommand):
+    help = ("Counts sources' photos and likes again, e.g. after photos were "
+            "changed outside of scraping")
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--source', nargs="+", type=str)
+
+    def handle(self, *args, **options):
+        sources = Source.objects.all()
+        if options['source']:
+            sources = sources.filter(name__in=options['source'])
+        Source.update_stats(sources)
+        print('Updated statistics for {} sources'.format(sources.count()))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone as tz
+from datetime import timedelta
+from scraping.models import *
+from scraping.throttle import RateLimiter
+
+
+class Command(BaseCommand):
+    help = ("Fetches notes for photos whose likes matter, e.g. after "
+            "scraping with --no-notes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--source', nargs="+", type=str)
+        # Photos posted in the last this many days
+        parser.add_argument('-d', '--days', type=int, default=7)
+        # Photos rated at least this highly
+        parser.add_argument('--min-rating', type=int, default=4)
+        # Photos whose posts have at least this many notes
+        parser.add_argument('--min-notes', type=int)
+        # Maximum photos to refresh per source
+        parser.add_argument('-l', '--limit', type=int, default=500)
+        # Maximum requests per second
+        parser.add_argument('--rate', type=float, default=1)
+
+    def handle(self, *args, **options):
+        if options['source']:
+            blogs = TumblrBlog.objects.filter(name__in=options['source'])
+        else:
+            blogs = TumblrBlog.objects.all()
+        wanted = (Q(posted__gte=tz.now() - timedelta(days=options['days'])) |
+                  Q(rating__gte=options['min_rating']))
+        if options['min_notes'] is not None:
+            wanted |= Q(note_count__gte=options['min_notes'])
+        throttle = RateLimiter(options['rate'])
+        for blog in blogs:
+            photos = (Photo.objects.filter(wanted, source=blog, deleted=False)
+                      .order_by('-posted')
+                      .only('id', 'post_url')[:options['limit']])
+            print('Refreshing likes from {}'.format(blog.name))
+            updated = blog.refresh_likes(photos, throttle)
+            print('Updated {} photos'.format(updated))
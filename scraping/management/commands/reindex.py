@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone as tz
+from scraping.models import *
+from scraping import nlp
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime as dt
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = ("Works out the words and ngrams of photos whose captions or tags "
+            "changed, or that were never processed, tagging and lemmatizing "
+            "in a pool of processes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--source', nargs="+", type=str)
+        # Only photos posted on or after this date, e.g. 2016-07-22
+        parser.add_argument('--since', type=str)
+        # Process photos even if they haven't changed
+        parser.add_argument('-f', '--force', action='store_true')
+        # Number of processes. 1 does everything in this one.
+        parser.add_argument('-w', '--workers', type=int,
+                            default=os.cpu_count())
+        # Number of photos read and written at a time
+        parser.add_argument('-c', '--chunk-size', type=int, default=1000)
+        # Number of photos handed to a process at a time
+        parser.add_argument('-b', '--batch-size', type=int, default=50)
+        parser.add_argument('-m', '--max-size', type=int, default=3)
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.filter(deleted=False)
+        if options['source']:
+            photos = photos.filter(source__name__in=options['source'])
+        if options['since']:
+            since = tz.make_aware(dt.strptime(options['since'], '%Y-%m-%d'))
+            photos = photos.filter(posted__gte=since)
+        pool = None
+        if options['workers'] > 1:
+            pool = ProcessPoolExecutor(options['workers'])
+        start = time.monotonic()
+        done = 0
+        checked = 0
+        last_id = 0
+        pending = None
+        try:
+            while last_id is not None:
+                # Read and hand out the next chunk before saving the last
+                # one, so the processes are busy while this one writes
+                last_id, read, chunk = self.read_chunk(
+                    photos, last_id, options['chunk_size'],
+                    options['max_size'], options['force'])
+                checked += read
+                analyzing = self.analyze(pool, chunk, options['batch_size'],
+                                         options['max_size'])
+                if pending:
+                    done += self.save(*pending)
+                    print('Reindexed {} of {} photos checked ({:.0f} per '
+                          'second)'.format(done, checked,
+                                           done / (time.monotonic() - start)))
+                pending = (chunk, analyzing) if chunk else None
+        finally:
+            if pool:
+                pool.shutdown()
+        print('Done. Reindexed {} of {} photos.'.format(done, checked))
+
+    # Reads the next chunk of photos after last_id. Returns a tuple of the
+    # last id read (None if there were none left), the number of photos read
+    # and a list of (id, caption, tags, fingerprint) tuples for those whose
+    # fingerprints have changed, or all of them if force is True.
+    def read_chunk(self, photos, last_id, chunk_size, max_size, force):
+        chunk = list(photos.filter(id__gt=last_id).order_by('id')
+                     .values_list('id', 'caption',
+                                  'nlp_fingerprint')[:chunk_size])
+        if not chunk:
+            return None, 0, []
+        tags = defaultdict(list)
+        for photo_id, tag_str in (Photo.tags.through.objects
+                                  .filter(photo_id__in=[c[0] for c in chunk])
+                                  .values_list('photo_id', 'tag__tag_str')):
+            tags[photo_id].append(tag_str)
+        changed = []
+        for photo_id, caption, old_fingerprint in chunk:
+            fingerprint = nlp.fingerprint(caption, tags[photo_id], max_size)
+            if force or fingerprint != old_fingerprint:
+                changed.append((photo_id, caption, tags[photo_id],
+                                fingerprint))
+        return chunk[-1][0], len(chunk), changed
+
+    # Starts analyzing a chunk in batches. Returns a list of futures, one per
+    # batch, or of the batches' results if there's no pool.
+    def analyze(self, pool, chunk, batch_size, max_size):
+        batches = [[(caption, tags) for _, caption, tags, _ in
+                    chunk[i:i + batch_size]]
+                   for i in range(0, len(chunk), batch_size)]
+        if pool is None:
+            return [nlp.analyze_all(b, max_size) for b in batches]
+        return [pool.submit(nlp.analyze_all, b, max_size) for b in batches]
+
+    # Waits for a chunk's analyses and saves them, replacing the photos'
+    # words and ngrams. Returns the number of photos saved.
+    def save(self, chunk, batches):
+        analyses = [a for batch in batches
+                    for a in (batch if isinstance(batch, list)
+                              else batch.result())]
+        Photo.save_analyses(
+            {photo_id: analysis for (photo_id, _, _, _), analysis
+             in zip(chunk, analyses)},
+            {photo_id: fingerprint for photo_id, _, _, fingerprint in chunk})
+        return len(chunk)
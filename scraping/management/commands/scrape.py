@@ -4,8 +4,13 @@
 from django.core.management.base import BaseCommand
 import re
 from scraping.models import *
-from datetime import datetime as dt
-from django.utils import timezone as tz
+from scraping.throttle import RateLimiter
+from scraping import instrumentation
+from django.db import connection
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+import traceback
 
 class Command(BaseCommand):
     help = "Scrapes sources for content"
@@ -14,8 +19,19 @@ class Command(BaseCommand):
         parser.add_argument('-s', '--source', nargs="+", type=str)
         parser.add_argument('-r', '--reset', action='store_true')
         depth = parser.add_mutually_exclusive_group()
-        depth.add_argument('-d', '--depth', type=int)
+        depth.add_argument('-d', '--depth', type=int, default=10)
         depth.add_argument('-a', '--all', action='store_true')
+        # Number of sources to scrape at once
+        parser.add_argument('-w', '--workers', type=int, default=1)
+        # Maximum requests per second, overall and to any one blog
+        parser.add_argument('--rate', type=float)
+        parser.add_argument('--host-rate', type=float)
+        # Skip notes; likes can be filled in later with refresh_likes
+        parser.add_argument('-n', '--no-notes', action='store_true')
+        # Print the time and queries spent in each stage for each source
+        parser.add_argument('-p', '--profile', action='store_true')
+        parser.add_argument('--profile-format', choices=['table', 'json'],
+                            default='table')
 
     def handle(self, *args, **options):
         print(options)
@@ -24,16 +40,92 @@ class Command(BaseCommand):
                     for n in options['source']
                     if self.url_match(n) is not None]
             print(urls)
-            sources_query = (Source.objects.filter(url__in=urls) |
-                             Source.objects.filter(name__in=options['source']))
+            sources_query = (TumblrBlog.objects.filter(url__in=urls) |
+                             TumblrBlog.objects.filter(
+                                 name__in=options['source']))
         else:
-            sources_query = Source.objects.all()
-        for source in sources_query:
+            sources_query = TumblrBlog.objects.all()
+        throttle = RateLimiter(options['rate'], options['host_rate'])
+        sources = list(sources_query)
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(options['workers']) as pool:
+                results = list(pool.map(
+                    lambda s: self.scrape_source(s, options, throttle,
+                                                 close_connection=True),
+                    sources))
+        else:
+            results = [self.scrape_source(s, options, throttle)
+                       for s in sources]
+        self.print_summary(results)
+        if options['profile']:
+            self.print_profiles([r['profile'] for r in results],
+                                options['profile_format'])
+
+    # Scrapes a single source. Returns a dict with the source, the time taken
+    # in seconds and the error raised, if any.
+    #   close_connection (bool):
+    #       whether to close the database connection afterwards. Each thread
+    #       gets its own connection, so worker threads close theirs when
+    #       they're done with a source.
+    def scrape_source(self, source, options, throttle, close_connection=False):
+        start = time.monotonic()
+        error = None
+        counts = {}
+        profile = None
+        try:
             if options['reset']:
                 print('Resetting scrape data for {}'.format(source.name))
-                source.tz.make_aware(dt.fromtimestamp(0))
+                source.reset_scraping()
             print('Scraping posts from {}'.format(source.name))
-            source.scrape(all=options['all'], max_depth=options['depth'])
+            if options['profile']:
+                with instrumentation.profiling(source.name) as profile:
+                    counts = self.scrape(source, options, throttle)
+            else:
+                counts = self.scrape(source, options, throttle)
+        except Exception as e:
+            print('Failed to scrape {}:'.format(source.name))
+            traceback.print_exc()
+            error = e
+        finally:
+            if close_connection:
+                connection.close()
+        return {'source': source,
+                'duration': time.monotonic() - start,
+                'counts': counts,
+                'profile': profile,
+                'error': error}
+
+    def scrape(self, source, options, throttle):
+        return source.scrape(all=options['all'], max_depth=options['depth'],
+                             throttle=throttle, notes=not options['no_notes'])
+
+    def print_summary(self, results):
+        print('\n{:30} {:>8} {:>8} {:>8} {:>8}  {}'.format(
+            'Source', 'Seconds', 'Inserted', 'Updated', 'Skipped', 'Result'))
+        for result in sorted(results, key=lambda r: -r['duration']):
+            counts = result['counts']
+            print('{:30.30} {:>8.1f} {:>8} {:>8} {:>8}  {}'.format(
+                result['source'].name, result['duration'],
+                counts.get('inserted', 0), counts.get('updated', 0),
+                counts.get('skipped', 0),
+                'Failed: {}'.format(result['error']) if result['error']
+                else 'OK'))
+        failed = len([r for r in results if r['error']])
+        print('\nScraped {} sources, {} failed'.format(len(results) - failed,
+                                                        failed))
+
+    def print_profiles(self, profiles, format):
+        profiles = [p for p in profiles if p]
+        total = instrumentation.Profile('Total')
+        for profile in profiles:
+            total.merge(profile)
+        if format == 'json':
+            print(json.dumps([p.as_dict() for p in profiles + [total]],
+                             indent=2))
+            return
+        for profile in profiles + [total]:
+            print('\n' + profile.name)
+            print('\n'.join(profile.table()))
 
     def url_match(self, string):
         tumblr_regex = '(http\:\/\/)?(?P<url>[A-Za-z0-9\-]+\.tumblr\.com).*'
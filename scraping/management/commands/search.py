@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from scraping.models import *
+from scraping import search
+import time
+
+
+class Command(BaseCommand):
+    help = "Searches photos by the words and ngrams of their captions and tags"
+
+    def add_arguments(self, parser):
+        parser.add_argument('query', nargs='*', type=str)
+        parser.add_argument('-s', '--source', type=str)
+        parser.add_argument('-p', '--page', type=int, default=1)
+        parser.add_argument('--per-page', type=int, default=20)
+        # Rebuild the index of every photo first
+        parser.add_argument('--rebuild', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            print('Rebuilding search index')
+            print('Indexed {} photos'.format(search.rebuild()))
+        if not options['query']:
+            return
+        source = None
+        if options['source']:
+            source = Source.objects.get(name=options['source'])
+        start = time.perf_counter()
+        results = search.search(' '.join(options['query']),
+                                 page=options['page'],
+                                 per_page=options['per_page'],
+                                 source=source)
+        seconds = time.perf_counter() - start
+        for photo, score in results:
+            print('{:>8.2f}  {}'.format(score, photo.photo_url))
+        print('{} results on page {} ({:.3f} seconds)'.format(
+            len(results), options['page'], seconds))
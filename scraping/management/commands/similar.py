@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.core.management.base import BaseCommand
+from scraping.models import *
+from scraping import similarity
+
+
+class Command(BaseCommand):
+    help = "Finds the photos most like the given ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('photo_id', nargs='*', type=int)
+        parser.add_argument('-k', type=int, default=10)
+        # Use the photos rated at least this highly, as well as any given
+        parser.add_argument('-r', '--min-rating', type=int)
+        # Index every photo again first, e.g. after reprocessing captions
+        parser.add_argument('--rebuild', action='store_true')
+
+    def handle(self, *args, **options):
+        index = similarity.index(rebuild=options['rebuild'])
+        if options['rebuild']:
+            print('Indexed {} photos'.format(len(index.photo_ids)))
+        photo_ids = list(options['photo_id'])
+        if options['min_rating'] is not None:
+            photo_ids += Photo.objects.filter(
+                rating__gte=options['min_rating'],
+                deleted=False).values_list('id', flat=True)
+        if not photo_ids:
+            return
+        results = index.similar(photo_ids, options['k'])
+        photos = Photo.objects.in_bulk([photo_id for photo_id, _ in results])
+        for photo_id, score in results:
+            print('{:>6.3f}  {:>8}  {}'.format(score, photo_id,
+                                               photos[photo_id].photo_url))
+        if not results:
+            print('No similar photos found')
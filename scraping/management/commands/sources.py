@@ -6,8 +6,7 @@ import re
 from scraping.models import *
 from datetime import datetime as dt
 from django.utils import timezone as tz
-from tumblpy import Tumblpy
-from api_keys import *
+from scraping import tumblr
 from django.db import IntegrityError
 from django.core.exceptions import ObjectDoesNotExist
 from utilities.cmd_line import trunc_print
@@ -65,33 +64,40 @@ class Command(BaseCommand):
             print('Deleted Tumblr blog {}\n'.format(name))
 
     def info(self, to_describe):
+        blogs = TumblrBlog.objects.order_by('name')
         if to_describe:
-            for source_string in to_describe:
-                source_url = self.get_url(source_string)['url']
-                if source_url:
-                    if TumblrBlog.objects.filter(url=source_url).exists():
-                        blog = TumblrBlog.objects.get(url=source_url)
-                        self.print_info(blog)
-        else:
-            [self.print_info(b) for b in TumblrBlog.objects.all()]
+            urls = [self.get_url(s) for s in to_describe]
+            blogs = blogs.filter(url__in=[u['url'] for u in urls if u])
+        # The statistics are stored on each source, so one query gets
+        # everything
+        [self.print_info(b) for b in blogs]
 
     def print_info(self, to_describe):
         cleaned_description = to_describe.description.split('\n')[0]
         # Check if ever been scraped. (I.e. time scraped should be after epoch)
-        scraped = to_describe.last_scraped < tz.make_aware(dt.fromtimestamp(0))
-        photo_num = str(Photo.objects.filter(source=to_describe).count())
+        scraped = to_describe.last_scraped > tz.make_aware(dt.fromtimestamp(0))
+        if to_describe.last_scrape_duration is not None:
+            duration = ' ({:.1f} seconds)'.format(
+                to_describe.last_scrape_duration)
+        else:
+            duration = ''
         info = ('',
                 # Blog's name
                 'Name:\t\t' + to_describe.name,
                 # The URL
                 'URL:\t\t' + to_describe.url,
                 # The date scraped, if ever, else 'Never'
-                'Last scraped:\t' + (str(to_describe.last_scraped)
+                'Last scraped:\t' + (str(to_describe.last_scraped) + duration
                                      if scraped else 'Never'),
                 # The first line of the description
                 'Description:\t' + cleaned_description,
                 # Number of photos
-                'Photos:\t\t' + photo_num,
+                'Photos:\t\t{} ({} deleted)'.format(to_describe.photo_count,
+                                                   to_describe.deleted_count),
+                # When the photos were posted
+                'Posted:\t\t{} to {}'.format(to_describe.oldest_posted,
+                                             to_describe.newest_posted),
+                'Likes:\t\t{}'.format(to_describe.total_likes),
                 '')
         # Print the info, truncated so each entry fits on one line
         trunc_print(*info)
@@ -101,13 +107,14 @@ class Command(BaseCommand):
         tumblr_url_regex = '(?P<url>(http\:\/\/)?[A-Za-z0-9\-]+\.tumblr\.com).*'
         tumblr_url_match = re.fullmatch(tumblr_url_regex, string)
         if tumblr_url_match:
-            return {'type': TumblrBlog, 'url': tumblr_url_match}
+            return {'type': TumblrBlog, 'url': tumblr_url_match.group('url')}
         # Check if it matches a tumblr name pattern
         tumblr_name_regex = '[A-Za-z0-9\-]+'
         tumblr_name_match = re.fullmatch(tumblr_name_regex, string).string
         # Check if a tumblr blog with that name exists
         if tumblr_name_match:
-            tumblr_agent = Tumblpy(TUMBLR['consumer'], TUMBLR['secret'])
+            from tumblpy.exceptions import TumblpyError
+            tumblr_agent = tumblr.client()
             try:
                 tumblr_agent.get('info', tumblr_name_match)
                 # tumblpy didn't throw an exception, so blog exists
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 23:26
+from __future__ import unicode_literals
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.timezone import utc
+
+# The schema before the app had migrations. Databases made then already have
+# these tables, so bring them up to date with migrate --fake-initial.
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ngram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expression', models.CharField(default='', max_length=500)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NgramAssociation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.IntegerField()),
+                ('ngram', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scraping.Ngram')),
+            ],
+            options={
+                'ordering': ['order'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Photo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_url', models.URLField(default='')),
+                ('photo_url', models.URLField(default='', unique=True)),
+                ('posted', models.DateTimeField(default=None, null=True)),
+                ('title', models.CharField(default='', max_length=200)),
+                ('caption', models.TextField(default='')),
+                ('likes', models.PositiveIntegerField(default=0)),
+                ('deleted', models.BooleanField(default=False)),
+                ('rating', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Source',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='', max_length=200)),
+                ('url', models.URLField(default='', unique=True)),
+                ('last_scraped', models.DateTimeField(default=datetime.datetime(1970, 1, 1, 0, 0, tzinfo=utc))),
+                ('description', models.TextField(default='')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag_str', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Word',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word_str', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WordAssociation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strength', models.PositiveIntegerField(default=1)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scraping.Photo')),
+                ('word', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scraping.Word')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TumblrBlog',
+            fields=[
+                ('source_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='scraping.Source')),
+                ('avatar_url', models.URLField(default='')),
+            ],
+            bases=('scraping.source',),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='words',
+            field=models.ManyToManyField(to='scraping.Word'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='associated_words',
+            field=models.ManyToManyField(through='scraping.WordAssociation', to='scraping.Word'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='ngrams',
+            field=models.ManyToManyField(to='scraping.Ngram'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='source',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='scraping.Source'),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='tags',
+            field=models.ManyToManyField(to='scraping.Tag'),
+        ),
+        migrations.AddField(
+            model_name='ngramassociation',
+            name='word',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scraping.Word'),
+        ),
+        migrations.AddField(
+            model_name='ngram',
+            name='words',
+            field=models.ManyToManyField(through='scraping.NgramAssociation', to='scraping.Word'),
+        ),
+    ]
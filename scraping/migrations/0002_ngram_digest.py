@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 23:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraping', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ngram',
+            name='digest',
+            field=models.CharField(default=None, max_length=40, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 23:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraping', '0002_ngram_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapeProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('in_progress', models.BooleanField(default=False)),
+                ('cutoff', models.BigIntegerField(default=0)),
+                ('oldest_timestamp', models.BigIntegerField(default=None, null=True)),
+                ('oldest_id', models.BigIntegerField(default=None, null=True)),
+                ('newest_timestamp', models.BigIntegerField(default=None, null=True)),
+                ('newest_id', models.BigIntegerField(default=None, null=True)),
+                ('source', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='scrape_progress', to='scraping.Source')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 23:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraping', '0004_photo_note_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=500)),
+                ('weight', models.FloatField(default=0)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scraping.Photo')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='posting',
+            unique_together=set([('term', 'photo')]),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 23:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraping', '0008_photo_nlp_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='deleted_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='last_scrape_duration',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='newest_posted',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='oldest_posted',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='total_likes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
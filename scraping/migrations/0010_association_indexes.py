@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 23:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Deletes associations that would break the new unique constraints, keeping
+# the first of each set of duplicates. Older code could store a photo's word,
+# or a word at one position of an ngram, more than once.
+def dedupe(apps, schema_editor):
+    quote = schema_editor.connection.ops.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        for name, columns in [('WordAssociation', ['photo_id', 'word_id']),
+                              ('NgramAssociation', ['ngram_id', 'order'])]:
+            table = quote(apps.get_model('scraping', name)._meta.db_table)
+            # The subquery is wrapped so MySQL allows deleting from the table
+            # it reads
+            cursor.execute(
+                'DELETE FROM {table} WHERE id NOT IN (SELECT id FROM '
+                '(SELECT MIN(id) AS id FROM {table} GROUP BY {columns}) '
+                'AS firsts)'.format(table=table, columns=', '.join(
+                    quote(c) for c in columns)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraping', '0009_source_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ngram',
+            name='expression',
+            field=models.CharField(db_index=True, default='', max_length=500),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ngramassociation',
+            unique_together=set([('ngram', 'order')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='wordassociation',
+            unique_together=set([('photo', 'word')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='photo',
+            index_together=set([('source', 'posted')]),
+        ),
+    ]
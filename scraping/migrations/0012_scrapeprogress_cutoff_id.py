@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-17 23:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraping', '0011_photo_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapeprogress',
+            name='cutoff_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
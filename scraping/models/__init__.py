@@ -1,2 +1,3 @@
 from .sources import *
-from .photos import *
\ No newline at end of file
+from .photos import *
+from .search import *
@@ -1,18 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.utils import timezone as tz
 from datetime import datetime as dt
 from scraping.models import Source
-from collections import defaultdict
-from nltk import pos_tag
-from nltk.stem import WordNetLemmatizer
+import scraping.models
+from collections import defaultdict, OrderedDict
+from scraping import database, instrumentation, nlp, vocabulary
+from scraping.nlp import LEMMATIZER
+import hashlib
 import re
 
 
 class Photo(models.Model):
 
+    class Meta:
+        # For a source's photos in the order they were posted, and all
+        # photos in that order, for keyset pagination; see scraping/views.py
+        index_together = [('source', 'posted'), ('posted', 'id')]
+
     # The source the photo came from
     source = models.ForeignKey(Source, null=True)
     # The url of the photo post or page.
@@ -27,6 +34,8 @@ class Photo(models.Model):
     caption = models.TextField(default='')
     # The number of times the photo was liked by users of the source
     likes = models.PositiveIntegerField(default=0)
+    # The number of notes (likes, reblogs, replies etc.) on the photo's post
+    note_count = models.PositiveIntegerField(default=0)
     # Any tags assigned to the photo at the source
     tags = models.ManyToManyField('tag')
     # Words from the title and caption, excluding most common ones.
@@ -38,21 +47,42 @@ class Photo(models.Model):
     rating = models.IntegerField(default=0)
     # Ngrams from the title and caption
     ngrams = models.ManyToManyField('ngram')
+    # The SHA-256 of the image file, once it's been downloaded. Names the file
+    # in the photo store; photos with the same image share one file.
+    sha256 = models.CharField(max_length=64, null=True, default=None,
+                              db_index=True)
+    # The size of the image file in bytes, and the image's dimensions in
+    # pixels. Only set once it's been downloaded.
+    file_size = models.PositiveIntegerField(null=True, default=None)
+    width = models.PositiveIntegerField(null=True, default=None)
+    height = models.PositiveIntegerField(null=True, default=None)
+    # The perceptual hash of the image, as 16 hex digits. Near-duplicate
+    # images have hashes a small Hamming distance apart; see scraping/phash.py
+    phash = models.CharField(max_length=16, null=True, default=None)
+    # The nlp.fingerprint of the caption and tags when the words and ngrams
+    # were last made. None if they never have been.
+    nlp_fingerprint = models.CharField(max_length=40, null=True,
+                                       default=None)
+    # When anything shown in the photo feed last changed. Set on save, but
+    # queryset updates of those fields must set it themselves.
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     # Returns instances based on information pulled from the Tumblr API
     # (tumblpy). Does not save to database.
     #   post (str):
     #       the post, a dictionary derived from tumblpy.
-    #       Must have notes info.
+    #       Likes are only counted if it has notes info.
     #       Via e.g. t.get('posts',
     #                      'blogname',
     #                      params={'notes_info': True})['posts'][0]
     #   source (Source):
     #       the source the post is derived from. must have been saved to the db.
     # Returns an array of dictionaries. Each dict is of the form
-    # {'photo': Photo, 'raw tags': tags} where tags is an array of strings.
+    # {'photo': Photo, 'raw tags': tags, 'has notes': bool} where tags is an
+    # array of strings and 'has notes' is whether likes were counted.
     # Tags must be created and saved after saving the Photo instance to the db.
     @classmethod
+    @instrumentation.profiled('from_tumblr_api')
     def from_tumblr_api(cls, post, source):
         photos = []
         if post['type'] != 'photo':
@@ -61,7 +91,8 @@ class Photo(models.Model):
         posted = tz.make_aware(dt.fromtimestamp(post['timestamp']))
         post_caption = post['caption']
         tags = post['tags']
-        likes = len([n for n in post['notes'] if n['type'] == 'like'])
+        has_notes = 'notes' in post
+        likes = cls.count_likes(post) if has_notes else 0
         for photo in post['photos']:
             # Create Photo
             instance = cls()
@@ -75,101 +106,286 @@ class Photo(models.Model):
             else:
                 instance.caption = post_caption
             instance.likes = likes
+            instance.note_count = post.get('note_count', 0)
             instance.source = source
-            photos.append({'photo': instance, 'raw tags': tags})
+            photos.append({'photo': instance, 'raw tags': tags,
+                           'has notes': has_notes})
         return photos
 
-    # Creates, saves, and assigns Tag instances to self.tags
-    def tags_from_ary(self, tags):
-        for raw_tag in tags:
-            # Remove characters other than letters and spaces and make lowercase
-            raw_tag = re.sub(r'[^a-zA-Z ]+', '', raw_tag).lower()
-            # If the tag exists, get it
-            if Tag.objects.filter(tag_str=raw_tag).exists():
-                tag = Tag.objects.get(tag_str=raw_tag)
-            # If it doesn't, make it
+    # Returns the number of likes in a post's notes info.
+    @staticmethod
+    def count_likes(post):
+        return len([n for n in post['notes'] if n['type'] == 'like'])
+
+    # Saves many photos at once, along with their tags. Photos whose
+    # photo_url is already in the database are updated instead, or skipped
+    # if nothing has changed. Returns a dict with the number of photos
+    # 'inserted', 'updated' and 'skipped'.
+    #   photos (list):
+    #       dicts of the form returned by from_tumblr_api.
+    #   update (bool):
+    #       whether to update the likes, note count and caption of photos
+    #       already in the database. Likes are left alone for photos without
+    #       notes info. If False, they're skipped.
+    @classmethod
+    @instrumentation.profiled('save_batch')
+    def save_batch(cls, photos, update=True):
+        counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        # If the same photo is in the batch twice, the later one wins
+        by_url = OrderedDict((d['photo'].photo_url, d) for d in photos)
+        counts['skipped'] += len(photos) - len(by_url)
+        existing = cls._ids_by_url(list(by_url), 'likes', 'note_count',
+                                   'caption')
+        new = []
+        # Photos whose search index weights change with their likes
+        reweigh = []
+        # The change in each source's likes from photos already saved
+        likes_added = defaultdict(int)
+        for url, photo_data in by_url.items():
+            photo = photo_data['photo']
+            if url not in existing:
+                new.append(photo_data)
+                continue
+            photo.id, likes, note_count, caption = existing[url]
+            photo._state.adding = False
+            # Without notes info the likes weren't counted
+            if not photo_data.get('has notes', True):
+                photo.likes = likes
+            if update and ((likes, note_count, caption) !=
+                           (photo.likes, photo.note_count, photo.caption)):
+                cls.objects.filter(id=photo.id).update(
+                    likes=photo.likes, note_count=photo.note_count,
+                    caption=photo.caption, modified=tz.now())
+                counts['updated'] += 1
+                if likes != photo.likes:
+                    reweigh.append(photo.id)
+                    likes_added[photo.source_id] += photo.likes - likes
             else:
-                tag = Tag(tag_str=raw_tag)
-                tag.save()
-                tag.make_words()
-            self.tags.add(tag)
+                counts['skipped'] += 1
+        try:
+            with transaction.atomic():
+                database.bulk_insert(cls, [d['photo'] for d in new])
+        except IntegrityError:
+            # Someone else saved some of them in the meantime, so fall back
+            # to saving them one at a time
+            saved = []
+            for photo_data in new:
+                try:
+                    with transaction.atomic():
+                        photo_data['photo'].save()
+                    saved.append(photo_data)
+                except IntegrityError:
+                    counts['skipped'] += 1
+            new = saved
+        # bulk_create doesn't set ids on every backend, so look them up
+        ids = cls._ids_by_url([d['photo'].photo_url for d in new])
+        for photo_data in new:
+            photo = photo_data['photo']
+            photo.id = ids[photo.photo_url][0]
+            photo._state.adding = False
+        counts['inserted'] = len(new)
+        cls._add_to_source_stats([d['photo'] for d in new], likes_added)
+        # Assign tags to the new photos, making any tags that don't exist yet
+        tags = {d['photo'].id: set(Tag.clean(t) for t in d['raw tags'])
+                for d in new}
+        tag_ids, created = vocabulary.TAGS.get_or_create(
+            t for photo_tags in tags.values() for t in photo_tags)
+        Tag.make_words_for({t: tag_ids[t] for t in created})
+        through = cls.tags.through
+        database.bulk_insert(
+            through,
+            [through(photo_id=photo_id, tag_id=tag_ids[t])
+             for photo_id, photo_tags in tags.items()
+             for t in photo_tags])
+        if reweigh:
+            scraping.models.search.Posting.index_photos(reweigh)
+        return counts
+
+    # Adds newly saved photos, and changes to the likes of others, to their
+    # sources' statistics.
+    #   photos (list):
+    #       the new photos.
+    #   likes_added (dict):
+    #       maps source ids to the change in their other photos' likes.
+    @staticmethod
+    def _add_to_source_stats(photos, likes_added):
+        by_source = defaultdict(list)
+        for photo in photos:
+            by_source[photo.source_id].append(photo)
+        for source_id in set(by_source) | set(likes_added):
+            if source_id is None:
+                continue
+            source_photos = by_source[source_id]
+            posted = [p.posted for p in source_photos if p.posted]
+            Source.add_to_stats(
+                source_id, photos=len(source_photos),
+                likes=(likes_added[source_id] +
+                       sum(p.likes for p in source_photos)),
+                oldest=min(posted) if posted else None,
+                newest=max(posted) if posted else None)
+
+    # Returns a dict mapping each url to a tuple of the id and any other
+    # given fields of the photo with that photo_url. Urls without photos are
+    # left out.
+    @classmethod
+    def _ids_by_url(cls, urls, *fields):
+        found = {}
+        # SQLite allows at most 999 parameters per query
+        for i in range(0, len(urls), 500):
+            for row in (cls.objects.filter(photo_url__in=urls[i:i + 500])
+                        .values_list('photo_url', 'id', *fields)):
+                found[row[0]] = row[1:]
+        return found
+
+    # Returns the id of the photo's post on Tumblr, taken from its url, or
+    # None if it doesn't have one.
+    def tumblr_post_id(self):
+        match = re.search(r'/post/(\d+)', self.post_url)
+        if match:
+            return int(match.group(1))
 
+    # Creates, saves, and assigns Tag instances to self.tags
+    @instrumentation.profiled('tags_from_ary')
+    def tags_from_ary(self, tags):
+        # Get the tags, making any that don't exist yet
+        tag_ids, created = vocabulary.TAGS.get_or_create(
+            Tag.clean(t) for t in tags)
+        Tag.make_words_for({t: tag_ids[t] for t in created})
+        self.tags.add(*tag_ids.values())
+        Photo.touch([self.id])
+
+    @instrumentation.profiled('get_words')
     def get_words(self):
         # TODO: Make it skip most common words
-        words = defaultdict(lambda: 0)
-        # Split caption and label parts of speech with NLTK
-        for word_str, pos in pos_tag(self.caption.split(), tagset='universal'):
-            # Only use adjectives, adverbs, nouns, verbs, and unknown
-            if pos in ['ADJ', 'ADV', 'NOUN', 'VERB', 'X']:
-                # Remove HTMl tags
-                word_str = re.sub('<[^>]*>', '', word_str)
-                # Remove non-letter characters
-                word_str = re.sub('[^a-zA-Z]+', '', word_str).lower()
-                # Lemmatize
-                word_str = Word.lemmatize(word_str)
-                # Increment count of word
-                words[word_str] += 1
-        for pos in self.tags.all():
-            for word in pos.words.all():
-                words[word.word_str] += 1
-        for word_str, strength in words.items():
-            # If word exists, get it
-            if Word.objects.filter(word_str=word_str).exists():
-                word = Word.objects.get(word_str=word_str)
-            # If it doesn't, make it
-            else:
-                word = Word(word_str=word_str)
-                word.save()
-            # If word association exists, get it and change strength
-            if WordAssociation.objects.filter(word=word, photo=self).exists():
-                association = WordAssociation.objects.get(word=word, photo=self)
-                association.strength = strength
-                association.save()
-            # If it does, make it with appropriate strength
-            else:
-                association = WordAssociation(word=word, photo=self,
-                                              strength=strength)
-                association.save()
+        tags = list(self.tags.values_list('tag_str', flat=True))
+        Photo.save_words({self.id: nlp.count_words(self.caption, tags)})
 
+    @instrumentation.profiled('make_ngrams')
     def make_ngrams(self, max_size=3):
         # Ngrams are just words if they're not at least two words long
         if max_size < 2:
             raise AttributeError('max_size must be >= 2')
-        # Make sure we actually have words for this photo
-        self.get_words()
-        # Make ngrams from each tag
-        for tag in self.tags.all():
-            self.make_ngrams_from_str(tag.tag_str, max_size)
-        # Remove HTML characters from caption
-        clean_caption = re.sub(r'<[^>]*>', '', self.caption)
-        # Remove characters that aren't letters or spaces and make lower case
-        clean_caption = re.sub(r'[^a-zA-Z ]+', '', clean_caption).lower()
-        self.make_ngrams_from_str(clean_caption, max_size)
-
-    def make_ngrams_from_str(self, str, max_size):
-        split_str = str.split()
-        # No point making an ngram from a single word
-        if len(split_str) > 1:
-            # Start with smallest ngrams, length 2
-            size = 2
-            # Stop once we're at the maximum size or the number of words in the
-            # string.
-            while size <= max_size and size <= len(split_str):
-                # The ngram is the whole string
-                if size == len(split_str):
-                    # TODO: Make it find Ngram if already exists
-                    ngram = Ngram.from_str(str)
-                    self.ngrams.add(ngram)
+        # Words and ngrams from the caption and each tag
+        tags = list(self.tags.values_list('tag_str', flat=True))
+        self.nlp_fingerprint = nlp.fingerprint(self.caption, tags, max_size)
+        Photo.save_analyses({self.id: nlp.analyze(self.caption, tags,
+                                                  max_size)},
+                            {self.id: self.nlp_fingerprint})
+
+    # Sets photos' modified time to now. Needed when their words, ngrams or
+    # tags change, which doesn't save the photos themselves, as the photo
+    # feed's Last-Modified comes from it.
+    #   photo_ids (iterable):
+    #       the photos' ids.
+    @classmethod
+    def touch(cls, photo_ids):
+        photo_ids = list(photo_ids)
+        now = tz.now()
+        # SQLite allows at most 999 parameters per query
+        for i in range(0, len(photo_ids), 500):
+            cls.objects.filter(id__in=photo_ids[i:i + 500]).update(
+                modified=now)
+
+    # Replaces the words and ngrams of many photos at once, and updates their
+    # search postings.
+    #   analyses (dict):
+    #       maps each photo's id to its (words, ngrams) tuple from
+    #       nlp.analyze.
+    #   fingerprints (dict):
+    #       if given, maps each photo's id to the nlp.fingerprint its
+    #       analysis was made from, to store with it.
+    @classmethod
+    @instrumentation.profiled('save_analyses')
+    def save_analyses(cls, analyses, fingerprints=None):
+        with transaction.atomic():
+            cls.save_words({p: words for p, (words, _) in analyses.items()})
+            cls.save_ngrams({p: ngrams for p, (_, ngrams) in analyses.items()})
+            scraping.models.search.Posting.index_photos(analyses)
+            for photo_id, fingerprint in (fingerprints or {}).items():
+                cls.objects.filter(id=photo_id).update(
+                    nlp_fingerprint=fingerprint)
+
+    # Sets the strengths of photos' words, making any words and associations
+    # that don't exist yet. Associations with words no longer in a photo are
+    # deleted. Photos whose words change are touched.
+    #   words (dict):
+    #       maps each photo's id to a dict of its word strings and their
+    #       strengths.
+    @classmethod
+    def save_words(cls, words):
+        # Get the words, making any that don't exist yet
+        word_ids = vocabulary.WORDS.ids(w for photo_words in words.values()
+                                        for w in photo_words)
+        photo_ids = list(words)
+        # Each photo and word has at most one association, so it can be
+        # looked up by the pair
+        associations = {}
+        # SQLite allows at most 999 parameters per query
+        for i in range(0, len(photo_ids), 500):
+            for row in (WordAssociation.objects
+                        .filter(photo_id__in=photo_ids[i:i + 500])
+                        .values_list('photo_id', 'word_id', 'id',
+                                     'strength')):
+                associations[row[:2]] = row[2:]
+        new_associations = []
+        changed = set()
+        for photo_id, photo_words in words.items():
+            for word_str, strength in photo_words.items():
+                association = associations.pop((photo_id, word_ids[word_str]),
+                                               None)
+                # If word association exists, change strength
+                if association:
+                    if association[1] != strength:
+                        WordAssociation.objects.filter(
+                            id=association[0]).update(strength=strength)
+                        changed.add(photo_id)
+                # If it doesn't, make it with appropriate strength
                 else:
-                    # Move down the string one word at a time, stopping when
-                    # the ngram would go past the end of the string
-                    for i in range(0, len(split_str) - size + 1):
-                        words = split_str[i:i + size]
-                        # Turn words back into string
-                        words = ' '.join(words)
-                        ngram = Ngram.from_str(words)
-                        self.ngrams.add(ngram)
-                size += 1
+                    new_associations.append(WordAssociation(
+                        word_id=word_ids[word_str], photo_id=photo_id,
+                        strength=strength))
+                    changed.add(photo_id)
+        # Whatever's left is no longer in the photos
+        stale = [association_id for association_id, _ in
+                 associations.values()]
+        changed.update(photo_id for photo_id, _ in associations)
+        for i in range(0, len(stale), 500):
+            WordAssociation.objects.filter(id__in=stale[i:i + 500]).delete()
+        database.bulk_insert(WordAssociation, new_associations)
+        cls.touch(changed)
+
+    # Sets photos' ngrams, making any ngrams that don't exist yet. Links to
+    # ngrams no longer in a photo are deleted. Photos whose ngrams change are
+    # touched.
+    #   ngrams (dict):
+    #       maps each photo's id to a list of its ngrams, each a tuple of
+    #       lemmatized words.
+    @classmethod
+    def save_ngrams(cls, ngrams):
+        ngram_ids = Ngram.ids_from_words(n for photo_ngrams in ngrams.values()
+                                         for n in photo_ngrams)
+        through = cls.ngrams.through
+        photo_ids = list(ngrams)
+        # Maps each (photo id, ngram id) pair already linked to the link's id
+        linked = {}
+        for i in range(0, len(photo_ids), 500):
+            for link_id, photo_id, ngram_id in (
+                    through.objects.filter(photo_id__in=photo_ids[i:i + 500])
+                    .values_list('id', 'photo_id', 'ngram_id')):
+                linked[(photo_id, ngram_id)] = link_id
+        links = set((photo_id, ngram_ids[n])
+                    for photo_id, photo_ngrams in ngrams.items()
+                    for n in photo_ngrams)
+        stale = [link for link in linked if link not in links]
+        for i in range(0, len(stale), 500):
+            through.objects.filter(
+                id__in=[linked[link] for link in stale[i:i + 500]]).delete()
+        new_links = [link for link in links if link not in linked]
+        database.bulk_insert(
+            through,
+            [through(photo_id=photo_id, ngram_id=ngram_id)
+             for photo_id, ngram_id in new_links])
+        cls.touch(set(photo_id for photo_id, _ in stale + new_links))
 
 
 class Tag(models.Model):
@@ -180,17 +396,37 @@ class Tag(models.Model):
     def __str__(self):
         return self.tag_str
 
+    # Returns a raw tag with characters other than letters and spaces
+    # removed, in lower case.
+    @staticmethod
+    def clean(raw_tag):
+        return re.sub(r'[^a-zA-Z ]+', '', raw_tag).lower()
+
     def make_words(self):
         # TODO: Make it skip most common words
         if self.words.all().count() == 0:
-            for tag_word in self.tag_str.split(' '):
-                tag_word = Word.lemmatize(tag_word)
-                if Word.objects.filter(word_str=tag_word).exists():
-                    word = Word.objects.get(word_str=tag_word)
-                else:
-                    word = Word(word_str=tag_word)
-                    word.save()
-                self.words.add(word)
+            Tag.make_words_for({self.tag_str: self.id})
+
+    # Creates, saves and assigns Word instances for many tags at once. Tags
+    # that already have words are left alone.
+    #   tags (dict):
+    #       maps each tag's string to its id.
+    @classmethod
+    def make_words_for(cls, tags):
+        through = cls.words.through
+        has_words = set(through.objects.filter(tag_id__in=tags.values())
+                        .values_list('tag_id', flat=True))
+        tag_words = {tag_id: nlp.tag_words(tag_str)
+                     for tag_str, tag_id in tags.items()
+                     if tag_id not in has_words}
+        word_ids = vocabulary.WORDS.ids(w for tag_word_strs in
+                                        tag_words.values()
+                                        for w in tag_word_strs)
+        database.bulk_insert(
+            through,
+            [through(tag_id=tag_id, word_id=word_ids[w])
+             for tag_id, tag_word_strs in tag_words.items()
+             for w in set(tag_word_strs)])
 
 
 class Word(models.Model):
@@ -202,58 +438,85 @@ class Word(models.Model):
 
     @staticmethod
     def lemmatize(string):
-        pos = pos_tag([string], tagset='universal')[0][1]
-        pos = {'NOUN': 'n', 'VERB': 'v', 'ADJ': 'a', 'ADV': 'r'}.get(pos)
-        if pos:
-            l = WordNetLemmatizer()
-            return l.lemmatize(string, pos)
-        else:
-            return string
+        return LEMMATIZER.lemmatize(string)
 
 
 class Ngram(models.Model):
 
     words = models.ManyToManyField(Word, through='NgramAssociation')
-    expression = models.CharField(max_length=500, default='')
+    expression = models.CharField(max_length=500, default='', db_index=True)
+    # The SHA-1 of the expression. Identifies the ngram by its lemmatized
+    # words, so each distinct ngram is only stored once. Null for ngrams
+    # stored before this existed; see the dedupe_ngrams command.
+    digest = models.CharField(max_length=40, unique=True, null=True,
+                              default=None)
 
     def __str__(self):
         return self.expression
 
     @classmethod
     def from_str(cls, str):
-        # Make the ngram
-        ngram = cls()
-        ngram.save()
-        split_str = str.split()
-        # Every word position in string. Using enumerate because we need the
-        # order.
-        for i, w in enumerate(split_str):
-            # Lemmatize
-            w = Word.lemmatize(w)
-            # Get word if it exists
-            if Word.objects.filter(word_str=w).exists():
-                word = Word.objects.get(word_str=w)
-            # Make it if it doesn't
-            else:
-                word = Word(word_str=w)
-                word.save()
-            # Make association
-            association = NgramAssociation(word=word, ngram=ngram, order=i)
-            association.save()
-        # Update the expression of the ngram
-        ngram.update_expression()
-        return ngram
-
-    def update_expression(self):
-        # Each word in order separated by spaces
-        self.expression = ' '.join([str(a.word) for a in
-                                    NgramAssociation.objects.filter(
-                                        ngram=self)])
-        self.save()
+        return cls.objects.get(id=cls.ids_from_strs([str])[str])
+
+    # Returns a dict mapping each string to the id of its Ngram, making and
+    # saving any ngrams that don't exist yet.
+    #   strs (list):
+    #       the strings, each a sequence of words separated by spaces.
+    @classmethod
+    def ids_from_strs(cls, strs):
+        # Lemmatize each word. The order of each list is the order of the
+        # words.
+        word_strs = {s: tuple(LEMMATIZER.lemmatize_all(s.split()))
+                     for s in set(strs)}
+        ngram_ids = cls.ids_from_words(word_strs.values())
+        return {s: ngram_ids[word_strs[s]] for s in strs}
+
+    # Returns a dict mapping each sequence of words to the id of its Ngram,
+    # making and saving any ngrams that don't exist yet.
+    #   word_lists (iterable):
+    #       tuples of lemmatized words, in order.
+    @classmethod
+    @instrumentation.profiled('ngram_from_str')
+    def ids_from_words(cls, word_lists):
+        # The expression is each word in order separated by spaces
+        expressions = {w: ' '.join(w) for w in set(word_lists)}
+        digests = {w: cls.make_digest(e) for w, e in expressions.items()}
+        with transaction.atomic():
+            ngram_ids, created = vocabulary.NGRAMS.get_or_create(
+                digests.values(),
+                defaults={digests[w]: {'expression': e}
+                          for w, e in expressions.items()})
+            if created:
+                cls._make_associations(
+                    {ngram_ids[digests[w]]: w for w in expressions
+                     if digests[w] in created})
+        return {w: ngram_ids[d] for w, d in digests.items()}
+
+    # Returns the digest identifying the ngram with the given expression.
+    @staticmethod
+    def make_digest(expression):
+        return hashlib.sha1(expression.encode('utf-8')).hexdigest()
+
+    # Makes the NgramAssociations for new ngrams.
+    #   ngrams (dict):
+    #       maps each ngram's id to its lemmatized words in order.
+    @staticmethod
+    def _make_associations(ngrams):
+        word_ids = vocabulary.WORDS.ids(w for word_strs in ngrams.values()
+                                        for w in word_strs)
+        database.bulk_insert(
+            NgramAssociation,
+            [NgramAssociation(word_id=word_ids[w], ngram_id=ngram_id,
+                              order=i)
+             for ngram_id, word_strs in ngrams.items()
+             for i, w in enumerate(word_strs)])
 
 
 class WordAssociation(models.Model):
 
+    class Meta:
+        unique_together = ('photo', 'word')
+
     photo = models.ForeignKey(Photo)
     word = models.ForeignKey(Word)
     strength = models.PositiveIntegerField(default=1)
@@ -263,6 +526,7 @@ class NgramAssociation(models.Model):
 
     class Meta:
         ordering = ['order']
+        unique_together = ('ngram', 'order')
 
     word = models.ForeignKey(Word)
     ngram = models.ForeignKey(Ngram)
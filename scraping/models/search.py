@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.db import models, transaction
+from scraping.models import Photo, WordAssociation
+from scraping import database
+from collections import defaultdict
+import math
+
+
+# One entry of the search index: a term found in a photo, and how strongly
+# it's associated with it. Terms are lemmatized words, or the expressions of
+# ngrams (which, unlike words, contain spaces). Searching only reads this
+# table, never the association tables it's built from.
+class Posting(models.Model):
+
+    class Meta:
+        unique_together = ('term', 'photo')
+
+    term = models.CharField(max_length=500)
+    photo = models.ForeignKey(Photo)
+    # The number of times the term is in the photo's caption and tags, scaled
+    # up for photos with more likes
+    weight = models.FloatField(default=0)
+
+    def __str__(self):
+        return self.term
+
+    # Returns how much a photo's likes scale up the weights of its terms.
+    @staticmethod
+    def likes_boost(likes):
+        return 1 + math.log1p(likes)
+
+    # Replaces the postings of photos with ones built from their current
+    # words, ngrams and likes.
+    #   photo_ids (iterable):
+    #       the ids of the photos to index.
+    @classmethod
+    def index_photos(cls, photo_ids):
+        photo_ids = list(photo_ids)
+        ngram_links = Photo.ngrams.through.objects
+        # SQLite allows at most 999 parameters per query
+        for i in range(0, len(photo_ids), 500):
+            chunk = photo_ids[i:i + 500]
+            boosts = {photo_id: cls.likes_boost(likes) for photo_id, likes in
+                      Photo.objects.filter(id__in=chunk)
+                      .values_list('id', 'likes')}
+            weights = defaultdict(float)
+            for photo_id, term, strength in (WordAssociation.objects
+                                             .filter(photo_id__in=chunk)
+                                             .values_list('photo_id',
+                                                          'word__word_str',
+                                                          'strength')):
+                weights[(term, photo_id)] += strength
+            for photo_id, term in (ngram_links.filter(photo_id__in=chunk)
+                                   .values_list('photo_id',
+                                                'ngram__expression')):
+                weights[(term, photo_id)] += 1
+            with transaction.atomic():
+                cls.objects.filter(photo_id__in=chunk).delete()
+                database.bulk_insert(
+                    cls,
+                    [cls(term=term, photo_id=photo_id,
+                         weight=weight * boosts[photo_id])
+                     for (term, photo_id), weight in weights.items()
+                     if term and photo_id in boosts])
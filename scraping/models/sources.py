@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (Case, Count, F, IntegerField, Max, Min, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.utils import timezone as tz
 from datetime import datetime as dt
-from tumblpy import Tumblpy
+from collections import defaultdict
 import scraping.models
-from tumblpy.exceptions import TumblpyError
-from api_keys import TUMBLR as TUMBLR_KEYS
+import time
+from scraping import database, instrumentation, pipeline, tumblr
 
 
 class Source(models.Model):
@@ -22,6 +25,77 @@ class Source(models.Model):
         dt.fromtimestamp(0)))
     # The human-readable description of the source.
     description = models.TextField(default='')
+    # Statistics about the source's photos, kept up to date as photos are
+    # saved so they don't have to be counted. See update_stats.
+    photo_count = models.PositiveIntegerField(default=0)
+    deleted_count = models.PositiveIntegerField(default=0)
+    # When the oldest and newest photos were posted
+    oldest_posted = models.DateTimeField(null=True, default=None)
+    newest_posted = models.DateTimeField(null=True, default=None)
+    # The likes of all the photos, deleted or not
+    total_likes = models.PositiveIntegerField(default=0)
+    # How long the last scrape took, in seconds
+    last_scrape_duration = models.FloatField(null=True, default=None)
+
+    # Forgets everything scraped so far, so the next scrape starts again from
+    # the newest post and goes back to the first.
+    def reset_scraping(self):
+        self.last_scraped = tz.make_aware(dt.fromtimestamp(0))
+        with database.ingest():
+            self.save(update_fields=['last_scraped'])
+            ScrapeProgress.objects.filter(source=self).delete()
+
+    # Adds newly saved photos to a source's statistics, in the database.
+    #   source_id (int):
+    #       the source's id.
+    #   photos (int):
+    #       the number of photos added.
+    #   likes (int):
+    #       the change in total likes.
+    #   oldest, newest (datetime):
+    #       when the oldest and newest photos added were posted, if any were.
+    @classmethod
+    def add_to_stats(cls, source_id, photos=0, likes=0, oldest=None,
+                     newest=None):
+        changes = {'photo_count': F('photo_count') + photos,
+                   'total_likes': F('total_likes') + likes}
+        if oldest is not None:
+            oldest = Value(oldest, output_field=models.DateTimeField())
+            changes['oldest_posted'] = Least(Coalesce('oldest_posted', oldest),
+                                             oldest)
+        if newest is not None:
+            newest = Value(newest, output_field=models.DateTimeField())
+            changes['newest_posted'] = Greatest(
+                Coalesce('newest_posted', newest), newest)
+        cls.objects.filter(id=source_id).update(**changes)
+
+    # Works out the statistics of sources from their photos again, with one
+    # query for all of them.
+    #   sources (QuerySet):
+    #       the sources to update. Defaults to all of them.
+    @classmethod
+    def update_stats(cls, sources=None):
+        if sources is None:
+            sources = cls.objects.all()
+        source_ids = list(sources.values_list('id', flat=True))
+        stats = {s['source']: s for s in
+                 scraping.models.photos.Photo.objects
+                 .filter(source_id__in=source_ids)
+                 .values('source')
+                 .annotate(photo_count=Count('id'),
+                           deleted_count=Sum(Case(
+                               When(deleted=True, then=1), default=0,
+                               output_field=IntegerField())),
+                           oldest_posted=Min('posted'),
+                           newest_posted=Max('posted'),
+                           total_likes=Sum('likes'))}
+        empty = {'photo_count': 0, 'deleted_count': 0, 'oldest_posted': None,
+                 'newest_posted': None, 'total_likes': 0}
+        with transaction.atomic():
+            for source_id in source_ids:
+                source_stats = stats.get(source_id, empty)
+                cls.objects.filter(id=source_id).update(
+                    **{k: source_stats[k] for k in empty})
 
 
 class TumblrBlog(Source):
@@ -36,8 +110,9 @@ class TumblrBlog(Source):
     #       of the blog (including '.tumblr.com').
     @classmethod
     def from_api(cls, name):
-        # Create tumblpy agent
-        agent = Tumblpy(TUMBLR_KEYS['consumer'], TUMBLR_KEYS['secret'])
+        from tumblpy.exceptions import TumblpyError
+        # Get the shared tumblr client
+        agent = tumblr.client()
         try:
             # Get blog info
             info = agent.get('info', name)['blog']
@@ -56,45 +131,226 @@ class TumblrBlog(Source):
         # Return without saving to db
         return instance
 
-    # Scrape blog using tumblr api (tumblpy), creating photos
+    # Scrape blog using tumblr api (tumblpy), creating photos. Pages of posts
+    # are fetched in the background while earlier ones are saved. Each page's
+    # photos are committed along with the blog's ScrapeProgress, so an
+    # interrupted scrape picks up where it left off.
     #   all (bool):
     #       if True, get all posts since last scraping. if False, only scrape
-    #       to a maximum depth
+    #       to a maximum depth; the next scrape carries on from there. Posts
+    #       made after an unfinished pass started aren't fetched until it
+    #       reaches the posts of the pass before (or the first post), so with
+    #       a large backlog they wait for several depth-limited scrapes.
     #   max_depth (int):
     #       the maximum number of times to pull from the tumblr api. (20 posts
     #       are pulled at a time.) if all is True, this is irrelevant.
-    def scrape(self, all=True, max_depth=10):
+    #   throttle (RateLimiter):
+    #       if given, waited on before each call to the tumblr api.
+    #   prefetch (int):
+    #       the maximum number of pages fetched but not yet saved.
+    #   notes (bool):
+    #       whether to fetch each post's notes to count its likes. Notes are
+    #       most of each response, so without them scraping is much lighter;
+    #       likes can be filled in later with refresh_likes.
+    # Returns a dict with the number of photos 'inserted', 'updated' and
+    # 'skipped'.
+    @instrumentation.profiled('scrape')
+    def scrape(self, all=True, max_depth=10, throttle=None, prefetch=2,
+               notes=True):
         # No maximum depth if scraping all posts
         max_depth = float('inf') if all else max_depth
-        # Create the tumblpy agent
-        agent = Tumblpy(TUMBLR_KEYS['consumer'], TUMBLR_KEYS['secret'])
-        offset = 0
-        posts = []
+        started = tz.now()
+        start = time.monotonic()
+        counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+        # Scrapes of other sources may be writing in other threads
+        with database.ingest():
+            progress = ScrapeProgress.start(self)
+        pages = pipeline.prefetch(self.pages(max_depth, throttle,
+                                             progress.cutoff_post(),
+                                             progress.oldest(), notes,
+                                             instrumentation.current()),
+                                  prefetch)
+        for posts, done in pages:
+            # Create photos from posts
+            photos = [photo_data
+                      for post in posts
+                      for photo_data in scraping.models.photos.Photo
+                      .from_tumblr_api(post, self)]
+            with database.ingest():
+                for key, count in self.save_photos(photos).items():
+                    counts[key] += count
+                progress.advance(posts)
+                if done:
+                    progress.in_progress = False
+                    self.last_scraped = started
+                    self.save(update_fields=['last_scraped'])
+                progress.save()
+        self.last_scrape_duration = time.monotonic() - start
+        with database.ingest():
+            Source.objects.filter(id=self.id).update(
+                last_scrape_duration=self.last_scrape_duration)
+        return counts
+
+    # Yields pages of posts from the tumblr api, newest first, as tuples
+    # (posts, done). done is True for the last page, once the posts reach
+    # ones scraped in an earlier pass or run out. Posts are ordered by
+    # (timestamp, id), as several can be made in one second. Pages after the
+    # first are requested by timestamp rather than offset, so new posts
+    # don't shift them. Doesn't use the database.
+    #   max_depth (int):
+    #       the maximum number of pages to pull.
+    #   throttle (RateLimiter):
+    #       if given, waited on before each call to the tumblr api.
+    #   cutoff (tuple):
+    #       the (timestamp, id) of the newest post scraped in an earlier pass.
+    #       It and older posts aren't yielded.
+    #   oldest (tuple):
+    #       the (timestamp, id) of the oldest post scraped so far in this
+    #       pass, to carry on from. None to start from the newest post.
+    #   notes (bool):
+    #       whether to include each post's notes.
+    #   profile (Profile):
+    #       if given, api calls are recorded in it as the 'http' stage. Since
+    #       pages usually runs in another thread, it has to be passed in.
+    def pages(self, max_depth, throttle=None, cutoff=(0, 0), oldest=None,
+              notes=True, profile=None):
+        # Get the shared tumblr client
+        agent = tumblr.client()
+        depth = 0
         # Pull 20 posts a max number of times equal to max_depth
-        while offset < max_depth:
+        while depth < max_depth:
+            params = {'limit': 20, 'notes_info': notes}
+            if oldest:
+                # Include the oldest post's second, in case other posts were
+                # made in it
+                params['before'] = oldest[0] + 1
             # Get 20 posts
-            new_posts = agent.get('posts', self.url,
-                              params={'offset': offset * 20,
-                                      'limit': 20,
-                                      'notes_info': True})
-            new_posts = new_posts['posts']
+            if throttle:
+                throttle.wait(self.url)
+            with instrumentation.stage('http', profile):
+                new_posts = agent.get('posts', self.url,
+                                      params=params)['posts']
+            # Drop posts already scraped this pass
+            if oldest:
+                new_posts = [p for p in new_posts
+                             if (p['timestamp'], p['id']) < oldest]
             # No posts found; stop scraping
             if not new_posts:
-                break
-            for post in new_posts:
-                # if any of the new posts is from before last scraping, stop
-                time = tz.make_aware(dt.fromtimestamp(post['timestamp']))
-                if time < self.last_scraped:
-                    offset = max_depth
-                    break
-            posts += new_posts
-            offset += 1
-        self.last_scraped = tz.now()
-        # Create photos from posts
-        for post in posts:
-            photos = scraping.models.photos.Photo.from_tumblr_api(post, self)
-            for photo_data in photos:
-                photo = photo_data['photo']
-                raw_tags = photo_data['raw tags']
-                photo.save()
-                photo.tags_from_ary(raw_tags)
+                yield [], True
+                return
+            # If any of the new posts is from before last scraping, stop
+            posts = [p for p in new_posts
+                     if (p['timestamp'], p['id']) > cutoff]
+            if len(posts) < len(new_posts):
+                yield posts, True
+                return
+            yield posts, False
+            oldest = min((p['timestamp'], p['id']) for p in posts)
+            depth += 1
+
+    # Fetches the notes of the posts photos came from and updates the photos'
+    # likes and note counts. Returns the number of photos updated.
+    #   photos (iterable):
+    #       photos from this blog.
+    #   throttle (RateLimiter):
+    #       if given, waited on before each call to the tumblr api.
+    def refresh_likes(self, photos, throttle=None):
+        Photo = scraping.models.photos.Photo
+        agent = tumblr.client()
+        # Posts can have several photos, but only need fetching once
+        photo_ids = defaultdict(list)
+        for photo in photos:
+            post_id = photo.tumblr_post_id()
+            if post_id:
+                photo_ids[post_id].append(photo.id)
+        updated = 0
+        for post_id, ids in photo_ids.items():
+            if throttle:
+                throttle.wait(self.url)
+            posts = agent.get('posts', self.url,
+                              params={'id': post_id,
+                                      'notes_info': True})['posts']
+            # The post has been deleted
+            if not posts:
+                continue
+            updated += Photo.objects.filter(id__in=ids).update(
+                likes=Photo.count_likes(posts[0]),
+                note_count=posts[0].get('note_count', 0), modified=tz.now())
+            # Search weights depend on likes
+            scraping.models.search.Posting.index_photos(ids)
+        Source.update_stats(Source.objects.filter(id=self.id))
+        return updated
+
+    # Saves photos and their tags in a single transaction. Returns the counts
+    # from Photo.save_batch.
+    #   photos (list):
+    #       dicts of the form returned by Photo.from_tumblr_api.
+    @staticmethod
+    def save_photos(photos):
+        with transaction.atomic():
+            return scraping.models.photos.Photo.save_batch(photos)
+
+
+# How far a source has been scraped. A pass goes from the newest post back to
+# the newest post of the previous pass (or the first post), and is saved after
+# every page so it can be resumed.
+class ScrapeProgress(models.Model):
+
+    source = models.OneToOneField(Source, related_name='scrape_progress')
+    # Whether a pass is underway
+    in_progress = models.BooleanField(default=False)
+    # The timestamp and id of the newest post from before this pass. The pass
+    # stops when it gets there.
+    cutoff = models.BigIntegerField(default=0)
+    cutoff_id = models.BigIntegerField(default=0)
+    # The timestamp and id of the oldest post reached this pass
+    oldest_timestamp = models.BigIntegerField(null=True, default=None)
+    oldest_id = models.BigIntegerField(null=True, default=None)
+    # The timestamp and id of the newest post ever seen
+    newest_timestamp = models.BigIntegerField(null=True, default=None)
+    newest_id = models.BigIntegerField(null=True, default=None)
+
+    # Returns the progress for a source, starting a new pass if the last one
+    # finished. Saves to database.
+    @classmethod
+    def start(cls, source):
+        progress, created = cls.objects.get_or_create(source=source)
+        if not progress.in_progress:
+            progress.in_progress = True
+            # Stop at the newest post seen so far, or at the last time the
+            # source was scraped if it was scraped before this was kept
+            if progress.newest_timestamp is not None:
+                progress.cutoff = progress.newest_timestamp
+                progress.cutoff_id = progress.newest_id
+            else:
+                # Posts made in the second it was scraped may have been
+                # missed, so they're fetched again
+                progress.cutoff = int(source.last_scraped.timestamp())
+                progress.cutoff_id = 0
+            progress.oldest_timestamp = None
+            progress.oldest_id = None
+            progress.save()
+        return progress
+
+    # Returns the (timestamp, id) of the newest post from before this pass.
+    def cutoff_post(self):
+        return self.cutoff, self.cutoff_id
+
+    # Returns the (timestamp, id) of the oldest post reached this pass, or
+    # None if none have been.
+    def oldest(self):
+        if self.oldest_timestamp is None:
+            return None
+        return self.oldest_timestamp, self.oldest_id
+
+    # Records that a page of posts has been scraped. Does not save to
+    # database.
+    def advance(self, posts):
+        if not posts:
+            return
+        self.oldest_timestamp, self.oldest_id = min(
+            (p['timestamp'], p['id']) for p in posts)
+        newest = max((p['timestamp'], p['id']) for p in posts)
+        if (self.newest_timestamp is None or
+                newest > (self.newest_timestamp, self.newest_id)):
+            self.newest_timestamp, self.newest_id = newest
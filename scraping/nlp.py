@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+from django.conf import settings
+from scraping import instrumentation
+from collections import Counter
+import hashlib
+import json
+import re
+
+# Universal part of speech tags and the WordNet equivalents
+WORDNET_POS = {'NOUN': 'n', 'VERB': 'v', 'ADJ': 'a', 'ADV': 'r'}
+# Change whenever the words or ngrams made from captions and tags change, so
+# reindex knows to process every photo again
+PIPELINE_VERSION = 2
+# The parts of speech of the caption words kept: adjectives, adverbs, nouns,
+# verbs, and unknown
+CAPTION_POS = ['ADJ', 'ADV', 'NOUN', 'VERB', 'X']
+
+
+# Lemmatizes words with a single shared WordNetLemmatizer, remembering the
+# results for the most recently used (word, part of speech) pairs. NLTK is
+# slow to import, so it's only loaded when the first word is lemmatized.
+#   max_size (int):
+#       the maximum number of results to remember.
+class Lemmatizer(object):
+
+    def __init__(self, max_size=50000):
+        self._lemmatizer = None
+        self._lemmatize = lru_cache(maxsize=max_size)(self._uncached)
+
+    # Returns the lemma of a single word.
+    #   word (str):
+    #       the word to lemmatize.
+    #   pos (str):
+    #       the word's universal part of speech tag, e.g. from the tagged
+    #       sentence it came from. If None, the word is tagged on its own.
+    def lemmatize(self, word, pos=None):
+        return self._lemmatize(word, pos)
+
+    # Returns the lemmas of a list of words, tagging them as one sentence.
+    #   words (list):
+    #       the words to lemmatize, in order.
+    def lemmatize_all(self, words):
+        return [self._lemmatize(w, pos) for w, pos in self.tag(words)]
+
+    # Returns a list of (word, universal part of speech tag) tuples.
+    @staticmethod
+    @instrumentation.profiled('pos_tag')
+    def tag(words):
+        words = list(words)
+        return pos_tag(words) if words else []
+
+    # Returns the hits, misses, maximum size and current size of the cache.
+    def cache_info(self):
+        return self._lemmatize.cache_info()
+
+    def cache_clear(self):
+        self._lemmatize.cache_clear()
+
+    @instrumentation.profiled('lemmatize')
+    def _uncached(self, word, pos):
+        if pos is None:
+            pos = pos_tag([word])[0][1]
+        pos = WORDNET_POS.get(pos)
+        if pos:
+            if self._lemmatizer is None:
+                from nltk.stem import WordNetLemmatizer
+                self._lemmatizer = WordNetLemmatizer()
+            return self._lemmatizer.lemmatize(word, pos)
+        else:
+            return word
+
+
+# Returns a list of (word, universal part of speech tag) tuples, importing
+# NLTK the first time it's called.
+def pos_tag(words):
+    from nltk import pos_tag
+    return pos_tag(words, tagset='universal')
+
+
+LEMMATIZER = Lemmatizer(getattr(settings, 'LEMMA_CACHE_SIZE', 50000))
+
+
+# Returns the lemmatized words of a tag, in order.
+#   tag (str):
+#       the tag, already cleaned (see Tag.clean).
+def tag_words(tag):
+    return LEMMATIZER.lemmatize_all(tag.split())
+
+
+# Returns the words of a caption as (lemma, universal part of speech tag)
+# tuples, in order. The caption is tagged once, as one sentence, and each
+# word lemmatized with its tag.
+#   caption (str):
+#       the caption, which may contain HTML.
+def caption_words(caption):
+    words = []
+    # Remove HTML tags, then split and label parts of speech with NLTK
+    for word_str, pos in LEMMATIZER.tag(re.sub(r'<[^>]*>', ' ',
+                                               caption).split()):
+        # Remove non-letter characters
+        word_str = re.sub('[^a-zA-Z]+', '', word_str).lower()
+        if word_str:
+            words.append((LEMMATIZER.lemmatize(word_str, pos), pos))
+    return words
+
+
+# Returns every run of 2 up to max_size words in a list of words, as tuples.
+def windows(words, max_size=3):
+    return [tuple(words[i:i + size])
+            for size in range(2, min(max_size, len(words)) + 1)
+            for i in range(0, len(words) - size + 1)]
+
+
+# Returns a Counter of the lemmatized words in a caption and tags. Caption
+# words count each time they appear; tag words count once for each tag
+# they're in.
+#   caption (str):
+#       the caption, which may contain HTML.
+#   tags (list):
+#       the photo's tags, already cleaned.
+def count_words(caption, tags):
+    return _count_words(caption_words(caption), [tag_words(t) for t in tags])
+
+
+# Returns the ngrams in a caption and tags, each a tuple of lemmatized words
+# in order, from 2 words long up to max_size words long. Ngrams don't span
+# tags or run from the caption into a tag.
+def ngram_words(caption, tags, max_size=3):
+    return _ngram_words(caption_words(caption), [tag_words(t) for t in tags],
+                        max_size)
+
+
+def _count_words(caption_words, tag_words):
+    words = Counter(w for w, pos in caption_words if pos in CAPTION_POS)
+    for tag_word_strs in tag_words:
+        words.update(set(tag_word_strs))
+    return words
+
+
+def _ngram_words(caption_words, tag_words, max_size):
+    ngrams = []
+    for words in tag_words + [[w for w, _ in caption_words]]:
+        ngrams += windows(words, max_size)
+    return ngrams
+
+
+# Returns the words and ngrams of a photo's caption and tags, as a tuple of
+# the Counter from count_words and the list from ngram_words. The caption and
+# each tag are only tagged once for both. Doesn't use the database, so it can
+# run in other processes.
+def analyze(caption, tags, max_size=3):
+    caption_lemmas = caption_words(caption)
+    tag_lemmas = [tag_words(t) for t in tags]
+    return (_count_words(caption_lemmas, tag_lemmas),
+            _ngram_words(caption_lemmas, tag_lemmas, max_size))
+
+
+# Returns the SHA-1 of a photo's whitespace-normalized caption, its set of
+# tags and the settings they're analyzed with. If it hasn't changed since a
+# photo was analyzed, analyzing it again would give the same results.
+def fingerprint(caption, tags, max_size=3):
+    key = json.dumps([PIPELINE_VERSION, max_size, ' '.join(caption.split()),
+                      sorted(set(tags))])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+# Returns the results of analyze for each of a list of (caption, tags)
+# tuples, for handing batches to a process pool.
+def analyze_all(texts, max_size=3):
+    return [analyze(caption, tags, max_size) for caption, tags in texts]
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from PIL import Image
+from scipy.fftpack import dct
+import numpy as np
+
+# The width and height images are shrunk to before hashing, and of the block
+# of lowest frequencies kept from their DCT
+IMAGE_SIZE = 32
+HASH_SIZE = 8
+
+
+# Returns the perceptual hash of an image file as an int of HASH_SIZE ** 2
+# bits, or None if it can't be read. The image is shrunk to greyscale and
+# each bit says whether one of its lowest frequencies is above their median,
+# so resizing, recompressing and small edits change few bits.
+#   path (str):
+#       the image file.
+def image_hash(path):
+    try:
+        with Image.open(path) as image:
+            image = image.convert('L').resize((IMAGE_SIZE, IMAGE_SIZE),
+                                              Image.LANCZOS)
+            pixels = np.asarray(image, dtype=np.float64)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    frequencies = dct(dct(pixels, axis=0, norm='ortho'), axis=1,
+                      norm='ortho')[:HASH_SIZE, :HASH_SIZE]
+    bits = (frequencies > np.median(frequencies)).ravel()
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+
+def to_hex(hash):
+    return '{:016x}'.format(hash)
+
+
+def from_hex(hex_hash):
+    return int(hex_hash, 16)
+
+
+# Returns the number of bits that differ between two hashes.
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+# A BK-tree of hashes, for finding those within a Hamming distance of a hash
+# without comparing it to every one. Each node's children are keyed by their
+# distance from it, so by the triangle inequality only children between
+# d - k and d + k away have to be searched.
+class BKTree(object):
+
+    def __init__(self):
+        # Each node is a list of [hash, items, {distance: child}]
+        self._root = None
+        self.size = 0
+
+    # Adds an item with a hash. Items with the same hash share a node.
+    def add(self, hash, item):
+        self.size += 1
+        if self._root is None:
+            self._root = [hash, [item], {}]
+            return
+        node = self._root
+        while True:
+            d = distance(hash, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [hash, [item], {}]
+                return
+            node = child
+
+    # Returns a list of (distance, item) tuples for the items whose hashes
+    # are at most max_distance from hash.
+    def find(self, hash, max_distance):
+        found = []
+        if self._root is None:
+            return found
+        to_search = [self._root]
+        while to_search:
+            node_hash, items, children = to_search.pop()
+            d = distance(hash, node_hash)
+            if d <= max_distance:
+                found += [(d, item) for item in items]
+            for child_distance, child in children.items():
+                if d - max_distance <= child_distance <= d + max_distance:
+                    to_search.append(child)
+        return found
+
+    def __len__(self):
+        return self.size
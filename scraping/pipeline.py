@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from itertools import islice
+from queue import Queue, Full
+from threading import Event, Thread
+
+# Marks the end of a prefetched iterable
+_DONE = object()
+
+
+# Iterates over an iterable in a background thread, staying at most size
+# items ahead of the consumer. Used to fetch the next pages of posts while
+# the current one is being saved. Exceptions raised by the iterable are
+# re-raised in the consumer.
+#   iterable (iterable):
+#       the items. Shouldn't use the database, since the thread has its own
+#       connection and transaction.
+#   size (int):
+#       the maximum number of items waiting to be consumed.
+def prefetch(iterable, size=2):
+    items = Queue(maxsize=size)
+    stop = Event()
+
+    # Puts an item on the queue unless the consumer has gone away. Returns
+    # False if it has.
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except Exception as e:
+            put((_DONE, e))
+
+    Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        # Stops the producer if the consumer stops early
+        stop.set()
+
+
+# Yields lists of up to size items from an iterable.
+def batched(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
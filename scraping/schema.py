@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.apps import apps
+from django.db import connection, transaction
+
+# The indexes the association_indexes and photo_modified migrations add, as
+# tuples of (model name, columns, unique). benchmark_indexes removes and adds
+# them again to measure what they're worth.
+INDEXES = [
+    # One association per photo and word, for upserts
+    ('WordAssociation', ('photo_id', 'word_id'), True),
+    # One word in each position of an ngram, in order
+    ('NgramAssociation', ('ngram_id', 'order'), True),
+    # A source's photos by when they were posted
+    ('Photo', ('source_id', 'posted'), False),
+    # All photos by when they were posted, for the photo feed
+    ('Photo', ('posted', 'id'), False),
+    ('Ngram', ('expression',), False),
+]
+
+
+def model(name):
+    return apps.get_model('scraping', name)
+
+
+# Returns the indexes in INDEXES that the database doesn't have.
+def missing():
+    with connection.cursor() as cursor:
+        found = []
+        for name, columns, unique in INDEXES:
+            table = model(name)._meta.db_table
+            constraints = connection.introspection.get_constraints(cursor,
+                                                                   table)
+            if not any(tuple(c['columns']) == columns and
+                       (c['unique'] or not unique) and
+                       (c['index'] or c['unique'])
+                       for c in constraints.values()):
+                found.append((name, columns, unique))
+    return found
+
+
+# Returns the SQL creating an index.
+def create_sql(name, columns, unique):
+    table = model(name)._meta.db_table
+    index_name = '{}_{}_{}'.format(table, '_'.join(columns),
+                                   'uniq' if unique else 'idx')
+    return 'CREATE {}INDEX {} ON {} ({})'.format(
+        'UNIQUE ' if unique else '', connection.ops.quote_name(index_name),
+        connection.ops.quote_name(table),
+        ', '.join(connection.ops.quote_name(c) for c in columns))
+
+
+# Adds the missing indexes. Returns a list of the indexes added. Only for
+# putting back what remove_indexes took away; migrations add them to real
+# databases.
+def add_indexes():
+    to_add = missing()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for index in to_add:
+            cursor.execute(create_sql(*index))
+    return to_add
+
+
+# Removes the indexes in INDEXES, leaving the tables as they were before the
+# migrations added them. Only for measuring what the indexes are worth, in
+# benchmark_indexes. On SQLite, the tables are copied without them.
+def remove_indexes():
+    with connection.schema_editor() as editor:
+        for name, columns, unique in INDEXES:
+            indexed_model = model(name)
+            meta = indexed_model._meta
+            if unique:
+                editor.alter_unique_together(indexed_model,
+                                             meta.unique_together, [])
+            elif len(columns) > 1:
+                editor.alter_index_together(indexed_model,
+                                            meta.index_together, [])
+            else:
+                field = meta.get_field(columns[0])
+                old_field = field.clone()
+                old_field.set_attributes_from_name(field.name)
+                old_field.model = indexed_model
+                old_field.db_index = False
+                editor.alter_field(indexed_model, field, old_field)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.db.models import Count, Sum
+from scraping.models import Photo, Posting
+from scraping import nlp
+from scraping.nlp import LEMMATIZER
+import re
+
+# The longest ngrams made from captions and tags
+MAX_NGRAM_SIZE = 3
+
+
+# Returns the terms to look up for a query: its lemmatized words and the
+# expressions of the ngrams they make, cleaned the same way as captions.
+#   query (str):
+#       e.g. 'baby lions'.
+def query_terms(query):
+    query = re.sub(r'<[^>]*>', '', query)
+    words = [re.sub(r'[^a-zA-Z]+', '', w).lower() for w in query.split()]
+    words = LEMMATIZER.lemmatize_all(w for w in words if w)
+    return words + [' '.join(ngram)
+                    for ngram in nlp.windows(words, MAX_NGRAM_SIZE)]
+
+
+# Returns a page of the photos matching a query, best first, as a list of
+# (Photo, score) tuples. Photos matching more of the query's terms come
+# first, then those whose terms have more weight. Deleted photos are left
+# out.
+#   query (str):
+#       the words to search for.
+#   page (int):
+#       which page of results to return, starting from 1.
+#   per_page (int):
+#       the number of results on each page.
+#   source (Source):
+#       if given, only photos from it are returned.
+def search(query, page=1, per_page=20, source=None):
+    terms = set(query_terms(query))
+    if not terms:
+        return []
+    postings = Posting.objects.filter(term__in=terms, photo__deleted=False)
+    if source is not None:
+        postings = postings.filter(photo__source=source)
+    start = (page - 1) * per_page
+    ranked = list(postings.values('photo_id')
+                  .annotate(matched=Count('id'), score=Sum('weight'))
+                  .order_by('-matched', '-score', '-photo_id')
+                  .values_list('photo_id', 'score')[start:start + per_page])
+    photos = Photo.objects.in_bulk([photo_id for photo_id, _ in ranked])
+    return [(photos[photo_id], score) for photo_id, score in ranked]
+
+
+# Rebuilds the whole index from the words and ngrams of every photo.
+#   chunk_size (int):
+#       the number of photos indexed at a time.
+# Returns the number of photos indexed.
+def rebuild(chunk_size=500):
+    last_id = 0
+    indexed = 0
+    while True:
+        chunk = list(Photo.objects.filter(id__gt=last_id).order_by('id')
+                     .values_list('id', flat=True)[:chunk_size])
+        if not chunk:
+            break
+        last_id = chunk[-1]
+        Posting.index_photos(chunk)
+        indexed += len(chunk)
+    # Drop postings of photos that no longer exist
+    Posting.objects.filter(photo_id__gt=last_id).delete()
+    return indexed
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone as tz
+from scipy import sparse
+from scraping.models import Photo, WordAssociation
+from datetime import datetime as dt, timedelta
+from threading import Lock
+import numpy as np
+import os
+
+EPOCH = tz.make_aware(dt(1970, 1, 1), tz.utc)
+
+
+# A photo-by-term matrix of how many times each word and ngram is in each
+# photo's caption and tags, for finding photos that are alike. Terms are
+# weighted by TF-IDF and photos compared by cosine similarity, all with
+# sparse matrix operations.
+#   path (str):
+#       where the index is saved between runs. None to keep it in memory.
+class SimilarityIndex(object):
+
+    def __init__(self, path=None):
+        self.path = path
+        self.clear()
+
+    # Forgets every photo.
+    def clear(self):
+        # The id of the photo in each row
+        self.photo_ids = np.zeros(0, dtype=np.int64)
+        # Maps each term to its column
+        self.terms = {}
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.float32)
+        # The modified time and id of the last photo read, in that order
+        self.last_modified = EPOCH
+        self.last_id = 0
+        self._rows = {}
+        self._weights = None
+
+    # Indexes the photos modified since the last update, a chunk at a time,
+    # replacing the rows of any already indexed. Saving a photo's words or
+    # ngrams touches it, so this picks up photos whatever order they're
+    # indexed in. Returns the number of photos added, replaced or removed.
+    #   chunk_size (int):
+    #       the number of photos read from the database at a time.
+    def update(self, chunk_size=500):
+        updated = 0
+        while True:
+            chunk = list(Photo.objects
+                         .filter(Q(modified__gt=self.last_modified) |
+                                 Q(modified=self.last_modified,
+                                   id__gt=self.last_id))
+                         .order_by('modified', 'id')
+                         .values_list('modified', 'id')[:chunk_size])
+            if not chunk:
+                break
+            self.last_modified, self.last_id = chunk[-1]
+            updated += self._replace([photo_id for _, photo_id in chunk])
+        return updated
+
+    # Forgets every photo and indexes them all again.
+    def rebuild(self, chunk_size=500):
+        self.clear()
+        return self.update(chunk_size)
+
+    # Replaces the rows of photos in the matrix with their current terms.
+    # Photos without words are left out. Returns the number of photos whose
+    # rows were added, replaced or removed.
+    #   photo_ids (list):
+    #       the photos' ids.
+    def _replace(self, photo_ids):
+        old_rows = self.rows(photo_ids)
+        old_ids = self.photo_ids[old_rows].tolist()
+        # Only photos with words are indexed
+        indexed = sorted(set(WordAssociation.objects
+                             .filter(photo_id__in=photo_ids)
+                             .values_list('photo_id', flat=True)))
+        rows = {photo_id: i for i, photo_id in enumerate(indexed)}
+        row_indices, columns, counts = [], [], []
+
+        def add(photo_id, term, count):
+            column = self.terms.setdefault(term, len(self.terms))
+            row_indices.append(rows[photo_id])
+            columns.append(column)
+            counts.append(count)
+        for photo_id, term, strength in (WordAssociation.objects
+                                         .filter(photo_id__in=indexed)
+                                         .values_list('photo_id',
+                                                      'word__word_str',
+                                                      'strength')):
+            add(photo_id, term, strength)
+        for photo_id, term in (Photo.ngrams.through.objects
+                               .filter(photo_id__in=indexed)
+                               .values_list('photo_id', 'ngram__expression')):
+            add(photo_id, term, 1)
+        # The old rows need the new terms' columns too
+        old = self.counts
+        old = sparse.csr_matrix((old.data, old.indices, old.indptr),
+                                shape=(old.shape[0], len(self.terms)))
+        keep = np.ones(old.shape[0], dtype=bool)
+        keep[old_rows] = False
+        new = sparse.csr_matrix((counts, (row_indices, columns)),
+                                shape=(len(indexed), len(self.terms)),
+                                dtype=np.float32)
+        self.counts = sparse.vstack([old[keep], new], format='csr')
+        self.photo_ids = np.concatenate([self.photo_ids[keep],
+                                         np.array(indexed, dtype=np.int64)])
+        self._rows = {}
+        self._weights = None
+        return len(set(indexed) | set(old_ids))
+
+    # Returns the matrix weighted by TF-IDF, with each row scaled to unit
+    # length so that dot products are cosine similarities. Worked out again
+    # after each update, since the IDFs change as photos are added.
+    def weights(self):
+        if self._weights is None:
+            # The number of photos each term is in
+            frequencies = np.bincount(self.counts.indices,
+                                      minlength=self.counts.shape[1])
+            idf = np.log((1 + len(self.photo_ids)) / (1 + frequencies)) + 1
+            weights = self.counts.copy()
+            # Repeated words count for less than their number of repeats
+            weights.data = 1 + np.log(weights.data)
+            weights = weights.multiply(idf.astype(np.float32)).tocsr()
+            norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1))
+                            .ravel())
+            norms[norms == 0] = 1
+            self._weights = sparse.diags(1 / norms).dot(weights).tocsr()
+        return self._weights
+
+    # Returns the row of each photo id, leaving out photos not in the index.
+    def rows(self, photo_ids):
+        if not self._rows:
+            self._rows = {photo_id: i for i, photo_id in
+                          enumerate(self.photo_ids.tolist())}
+        return [self._rows[p] for p in photo_ids if p in self._rows]
+
+    # Returns the k photos most like the given ones, as a list of
+    # (photo_id, similarity) tuples, most similar first. Photos are compared
+    # with the given photos' combined terms, e.g. to find photos like the
+    # ones rated highly. The given photos and deleted photos are left out.
+    #   photo_ids (iterable):
+    #       the ids of the photos to find similar ones to.
+    #   k (int):
+    #       the maximum number of photos to return.
+    def similar(self, photo_ids, k=10):
+        photo_ids = set(photo_ids)
+        rows = self.rows(photo_ids)
+        if not rows:
+            return []
+        weights = self.weights()
+        query = sparse.csr_matrix(weights[rows].sum(axis=0))
+        scores = np.asarray(weights.dot(query.T).todense()).ravel()
+        scores[rows] = 0
+        return self._top(scores, k)
+
+    # Returns the k photos most like each given photo, as a dict mapping
+    # each photo's id to a list like the one from similar. Every photo is
+    # compared in one matrix product.
+    def similar_each(self, photo_ids, k=10):
+        photo_ids = [p for p in photo_ids if self.rows([p])]
+        if not photo_ids:
+            return {}
+        weights = self.weights()
+        rows = self.rows(photo_ids)
+        scores = weights[rows].dot(weights.T).toarray()
+        results = {}
+        for photo_id, row, photo_scores in zip(photo_ids, rows, scores):
+            photo_scores[row] = 0
+            results[photo_id] = self._top(photo_scores, k)
+        return results
+
+    # Returns the photos with the k highest scores that aren't deleted.
+    def _top(self, scores, k):
+        results = []
+        # Ask for more than k in case some are deleted
+        wanted = k
+        while len(results) < k:
+            wanted = min(wanted * 2, len(scores))
+            best = np.argpartition(-scores, wanted - 1)[:wanted]
+            best = best[np.argsort(-scores[best], kind='stable')]
+            best = best[scores[best] > 0]
+            ids = self.photo_ids[best].tolist()
+            deleted = set(Photo.objects.filter(id__in=ids, deleted=True)
+                          .values_list('id', flat=True))
+            results = [(photo_id, float(scores[row]))
+                       for photo_id, row in zip(ids, best)
+                       if photo_id not in deleted][:k]
+            if wanted == len(scores) or len(best) < wanted:
+                break
+        return results
+
+    # Saves the index to self.path.
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        terms = sorted(self.terms, key=self.terms.get)
+        # Write to a temporary file first so readers never see half a file
+        temp_path = self.path + '.tmp.npz'
+        np.savez_compressed(temp_path, data=self.counts.data,
+                            indices=self.counts.indices,
+                            indptr=self.counts.indptr,
+                            photo_ids=self.photo_ids,
+                            terms=np.array(terms, dtype=str),
+                            last_modified=(self.last_modified - EPOCH) //
+                            timedelta(microseconds=1),
+                            last_id=self.last_id)
+        os.replace(temp_path, self.path)
+
+    # Loads the index from self.path. Returns False if it hasn't been saved.
+    def load(self):
+        try:
+            stored = np.load(self.path, allow_pickle=False)
+        except FileNotFoundError:
+            return False
+        self.clear()
+        self.terms = {t: i for i, t in enumerate(stored['terms'].tolist())}
+        self.photo_ids = stored['photo_ids']
+        self.counts = sparse.csr_matrix(
+            (stored['data'], stored['indices'], stored['indptr']),
+            shape=(len(self.photo_ids), len(self.terms)))
+        # Indexes saved before modified times were kept are brought up to
+        # date by updating every photo
+        if 'last_modified' in stored:
+            self.last_modified = EPOCH + timedelta(
+                microseconds=int(stored['last_modified']))
+            self.last_id = int(stored['last_id'])
+        return True
+
+
+_index = None
+_index_lock = Lock()
+
+
+# Returns the shared SimilarityIndex, loaded from the file given by the
+# SIMILARITY_INDEX setting and brought up to date with changed photos.
+#   rebuild (bool):
+#       whether to index every photo again instead, e.g. after reprocessing
+#       captions.
+def index(rebuild=False):
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex(getattr(settings, 'SIMILARITY_INDEX',
+                                             None))
+            # No point loading an index that's about to be thrown away
+            if _index.path and not rebuild:
+                _index.load()
+        changed = _index.rebuild() if rebuild else _index.update()
+        if (changed or rebuild) and _index.path:
+            _index.save()
+        return _index
+
+
+# Returns the k photos most like the given ones. See SimilarityIndex.similar.
+def similar(photo_ids, k=10):
+    return index().similar(photo_ids, k)
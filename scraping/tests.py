@@ -1,9 +1,35 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.db.migrations.executor import MigrationExecutor
+from django.db import connection, connections, IntegrityError, transaction
+from django.core.management import call_command
 from django.utils import timezone as tz
 from scraping.models import *
+from scraping import vocabulary
+from scraping.nlp import Lemmatizer, analyze
+from scraping.throttle import RateLimiter
+from scraping import instrumentation, pipeline, search, similarity, tumblr
+from scraping.similarity import SimilarityIndex
+from scraping.downloads import Downloader, PhotoStore
+from scraping import database, export, phash, schema
+from django.test import override_settings
+from unittest import skipUnless
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from PIL import Image
+from threading import Thread
+from scraping.http_cache import ResponseCache, CacheMiss
+from scraping.benchmarks.synthetic import make_posts, StandInClient
+from scraping.benchmarks import startup
+from datetime import datetime as dt, timedelta
+import csv
+import io
+import json
+import math
+import os
+import tempfile
+import time
 
 BLOG_NAME = 'njwight'
 BLOG_TITLE = '''NJ Wight's Wild! Life'''
@@ -15,9 +41,31 @@ PHOTO_URL = 'https://66.media.tumblr.com/b39bd96d0194bfc9579cc2d0484c2f2e/tumblr
 PHOTO_CAPTION = '<p>Nice left hook! Little lions frolicking.</p>'
 
 
+# Replaces the shared tumblr client with one that replays the given
+# responses without using the network, for the rest of the test.
+#   responses (list):
+#       tuples of (response, endpoint, blog_url, params).
+def replay_tumblr(test, responses):
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    cache = ResponseCache(directory.name, mode='replay')
+    for response in responses:
+        cache.put(*response)
+    old_client = tumblr.set_client(tumblr.TumblrClient(
+        keys={'consumer': '', 'secret': ''}, cache=cache))
+    test.addCleanup(tumblr.set_client, old_client)
+
+
 class EffectTest(TestCase):
 
     def setUp(self):
+        vocabulary.clear()
+        replay_tumblr(self, [
+            ({'blog': {'url': 'http://' + BLOG_NAME + '.tumblr.com/',
+                       'title': BLOG_TITLE,
+                       'description': BlOG_DESCRIPTION}},
+             'info', BLOG_NAME, None),
+            ({'url': AVATAR_URL}, 'avatar', BLOG_NAME, {'size': 512})])
         blog = TumblrBlog.from_api(BLOG_NAME)
         blog.save()
         photo_data = Photo.from_tumblr_api(POST, blog)
@@ -65,3 +113,1068 @@ class EffectTest(TestCase):
         for n in ngrams:
             assert Ngram.objects.filter(expression=n).exists()
 
+
+# Ids are only cached once their transaction commits, which TestCase never
+# does
+class VocabularyTest(TransactionTestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+        Word(word_str='lion').save()
+
+    def test_ids(self):
+        ids = vocabulary.WORDS.ids(['lion', 'cat', 'lion'])
+        assert set(ids) == {'lion', 'cat'}
+        assert Word.objects.get(word_str='lion').id == ids['lion']
+        assert Word.objects.get(word_str='cat').id == ids['cat']
+
+    def test_created(self):
+        ids, created = vocabulary.TAGS.get_or_create(['big cats', 'lions'])
+        assert sorted(created) == ['big cats', 'lions']
+        ids, created = vocabulary.TAGS.get_or_create(['big cats', 'animals'])
+        assert created == ['animals']
+        assert Tag.objects.count() == 3
+
+    def test_cache(self):
+        ids = vocabulary.WORDS.ids(['lion', 'cat'])
+        with self.assertNumQueries(0):
+            assert vocabulary.WORDS.ids(['cat', 'lion']) == ids
+
+    def test_max_size(self):
+        words = vocabulary.Vocabulary('scraping.Word', 'word_str', max_size=2)
+        for word_str in ['lion', 'cat', 'hook']:
+            words.ids([word_str])
+        with self.assertNumQueries(1):
+            words.ids(['lion'])
+
+    def test_rollback(self):
+        try:
+            with transaction.atomic():
+                vocabulary.WORDS.ids(['cat'])
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        # The rolled back row isn't cached, so it's created again
+        ids, created = vocabulary.WORDS.get_or_create(['cat'])
+        assert created == ['cat']
+        assert Word.objects.get(word_str='cat').id == ids['cat']
+
+
+class LemmatizerTest(TestCase):
+
+    def test_lemmatize(self):
+        lemmatizer = Lemmatizer()
+        assert lemmatizer.lemmatize('lions', 'NOUN') == 'lion'
+        assert lemmatizer.lemmatize('lions', 'NOUN') == 'lion'
+        assert lemmatizer.lemmatize('quickly', '.') == 'quickly'
+        info = lemmatizer.cache_info()
+        assert info.hits == 1
+        assert info.misses == 2
+
+    def test_lemmatize_all(self):
+        lemmatizer = Lemmatizer()
+        assert lemmatizer.lemmatize_all(['baby', 'animals']) == ['baby',
+                                                                 'animal']
+        assert lemmatizer.lemmatize_all([]) == []
+
+
+class NgramTest(TestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+
+    def test_from_str(self):
+        ngram = Ngram.from_str('baby animals')
+        assert ngram.expression == 'baby animal'
+        assert Ngram.from_str('baby  animals') == ngram
+        assert Ngram.objects.count() == 1
+        assert NgramAssociation.objects.count() == 2
+
+    def test_dedupe(self):
+        photo = Photo(photo_url=PHOTO_URL)
+        photo.save()
+        words = [Word.objects.create(word_str=w) for w in ['big', 'cat']]
+        # Two copies of the same ngram, stored without digests
+        for _ in range(2):
+            ngram = Ngram.objects.create(expression='big cat')
+            for i, word in enumerate(words):
+                NgramAssociation.objects.create(word=word, ngram=ngram,
+                                                order=i)
+            photo.ngrams.add(ngram)
+        call_command('dedupe_ngrams')
+        assert Ngram.objects.count() == 1
+        ngram = Ngram.objects.get()
+        assert ngram.digest == Ngram.make_digest('big cat')
+        assert list(photo.ngrams.all()) == [ngram]
+        assert NgramAssociation.objects.count() == 2
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+        self.photos = []
+        for i, (caption, likes) in enumerate([('Little lions playing', 0),
+                                              ('Little lions sleeping', 20),
+                                              ('A sleeping cat', 50)]):
+            photo = Photo(photo_url=PHOTO_URL + str(i), caption=caption,
+                          likes=likes)
+            photo.save()
+            photo.tags_from_ary(['lions'])
+            photo.make_ngrams()
+            self.photos.append(photo)
+
+    def test_search(self):
+        results = [photo for photo, score in search.search('little lions')]
+        # More likes rank higher, and matching more terms higher still
+        assert results == [self.photos[1], self.photos[0], self.photos[2]]
+        results = search.search('little lions', page=2, per_page=2)
+        assert [photo for photo, score in results] == [self.photos[2]]
+
+    def test_deleted(self):
+        Photo.objects.filter(id=self.photos[1].id).update(deleted=True)
+        results = [photo for photo, score in search.search('little lions')]
+        assert self.photos[1] not in results
+
+    def test_rebuild(self):
+        Posting.objects.all().delete()
+        assert search.search('lions') == []
+        assert search.rebuild() == 3
+        assert len(search.search('lions')) == 3
+
+
+class SimilarityTest(TestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+        self.photos = []
+        for i, caption in enumerate(['Little lions playing in the grass',
+                                     'Little lions sleeping in the grass',
+                                     'An elephant drinking',
+                                     'A baby elephant drinking']):
+            photo = Photo(photo_url=PHOTO_URL + str(i), caption=caption)
+            photo.save()
+            photo.make_ngrams()
+            self.photos.append(photo)
+
+    def test_similar(self):
+        index = SimilarityIndex()
+        assert index.update() == 4
+        lions, sleeping_lions, elephant, baby_elephant = [
+            p.id for p in self.photos]
+        assert index.similar([lions], k=1)[0][0] == sleeping_lions
+        assert index.similar([elephant], k=1)[0][0] == baby_elephant
+        results = index.similar_each([lions, elephant], k=1)
+        assert results[elephant][0][0] == baby_elephant
+        Photo.objects.filter(id=baby_elephant).update(deleted=True)
+        assert baby_elephant not in [p for p, _ in index.similar([elephant])]
+
+    def test_update(self):
+        index = SimilarityIndex()
+        index.update()
+        photo = Photo(photo_url=PHOTO_URL + 'new',
+                      caption='Little lions playing in the grass')
+        photo.save()
+        photo.make_ngrams()
+        assert index.update() == 1
+        assert index.update() == 0
+        results = index.similar([self.photos[0].id], k=1)
+        assert results[0][0] == photo.id
+        assert results[0][1] > 0.99
+
+    def test_changed_words(self):
+        index = SimilarityIndex()
+        index.update()
+        lions, elephant = self.photos[0], self.photos[2]
+        # The elephant photo, already indexed, gets the same words as the
+        # lions
+        Photo.save_words({elephant.id: dict(
+            lions.wordassociation_set.values_list('word__word_str',
+                                                  'strength'))})
+        Photo.save_ngrams({elephant.id: [
+            tuple(e.split())
+            for e in lions.ngrams.values_list('expression', flat=True)]})
+        assert index.update() == 1
+        results = index.similar([lions.id], k=1)
+        assert results[0][0] == elephant.id
+        assert results[0][1] > 0.99
+        # And then loses them
+        Photo.save_words({elephant.id: {}})
+        Photo.save_ngrams({elephant.id: []})
+        assert index.update() == 1
+        assert index.rows([elephant.id]) == []
+        assert len(index.photo_ids) == 3
+
+    def test_rebuild(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + '/similarity.npz'
+            stale = SimilarityIndex(path)
+            stale.save()
+            self.addCleanup(setattr, similarity, '_index', None)
+            similarity._index = None
+            with override_settings(SIMILARITY_INDEX=path):
+                call_command('similar', rebuild=True)
+            loaded = SimilarityIndex(path)
+            assert loaded.load()
+            assert len(loaded.photo_ids) == 4
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as directory:
+            index = SimilarityIndex(directory + '/similarity.npz')
+            index.update()
+            index.save()
+            loaded = SimilarityIndex(index.path)
+            assert loaded.load()
+            assert loaded.update() == 0
+            assert (loaded.similar([self.photos[0].id]) ==
+                    index.similar([self.photos[0].id]))
+
+
+# Serves images from a dict mapping paths to bytes, standing in for Tumblr's
+# image servers.
+class ImageHandler(BaseHTTPRequestHandler):
+
+    images = {}
+
+    def do_GET(self):
+        image = self.images.get(self.path)
+        if image is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(image)))
+        self.end_headers()
+        self.wfile.write(image)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTest(TestCase):
+
+    def setUp(self):
+        images = {}
+        for name, size in [('a', (30, 20)), ('b', (10, 10))]:
+            image = io.BytesIO()
+            Image.new('RGB', size).save(image, 'PNG')
+            images[name] = image.getvalue()
+        ImageHandler.images = {'/a.png': images['a'], '/b.png': images['b'],
+                               # The same image at a different url
+                               '/copy_of_a.png': images['a']}
+        server = HTTPServer(('127.0.0.1', 0), ImageHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = 'http://127.0.0.1:{}/'.format(server.server_port)
+        for name in ['a', 'b', 'copy_of_a', 'missing']:
+            Photo.objects.create(photo_url=base_url + name + '.png')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = PhotoStore(directory.name)
+
+    def test_download(self):
+        downloader = Downloader(self.store, workers=2, retries=0)
+        counts = downloader.run(Photo.objects.all(), chunk_size=2)
+        assert counts == {'downloaded': 3, 'failed': 1}
+        a = Photo.objects.get(photo_url__endswith='/a.png')
+        copy = Photo.objects.get(photo_url__endswith='/copy_of_a.png')
+        assert (a.width, a.height) == (30, 20)
+        assert a.sha256 == copy.sha256
+        assert a.file_size == len(ImageHandler.images['/a.png'])
+        assert self.store.exists(a.sha256)
+        # Only two distinct images were stored
+        files = [f for _, _, names in os.walk(self.store.directory)
+                 for f in names]
+        assert len(files) == 2
+        # Downloaded photos aren't fetched again
+        assert downloader.run(Photo.objects.all()) == {'downloaded': 0,
+                                                       'failed': 1}
+
+    def test_limit(self):
+        downloader = Downloader(self.store, workers=2, retries=0)
+        assert downloader.run(Photo.objects.all(), limit=1) == {
+            'downloaded': 1, 'failed': 0}
+
+
+class PhashTest(TestCase):
+
+    # Returns a PNG of a pattern, as bytes.
+    @staticmethod
+    def image(size, pattern=0):
+        image = Image.new('L', (64, 64))
+        image.putdata([int(127 + 127 * math.sin(x / (8 + pattern)) *
+                           math.cos(y / (5 + pattern)))
+                       for y in range(64) for x in range(64)])
+        output = io.BytesIO()
+        image.resize(size).save(output, 'PNG')
+        return output.getvalue()
+
+    def test_bk_tree(self):
+        tree = phash.BKTree()
+        hashes = [0, 1, 3, 0xff, 0xf0f0, 2 ** 63, 2 ** 64 - 1, 7]
+        for i, hash in enumerate(hashes):
+            tree.add(hash, i)
+        for hash in [0, 5, 0xf0ff]:
+            for k in range(4):
+                expected = sorted((phash.distance(hash, h), i)
+                                  for i, h in enumerate(hashes)
+                                  if phash.distance(hash, h) <= k)
+                assert sorted(tree.find(hash, k)) == expected
+        assert len(tree) == len(hashes)
+
+    def test_dedupe(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = PhotoStore(directory.name)
+        for i, (size, pattern) in enumerate([((64, 64), 0), ((32, 32), 0),
+                                             ((64, 64), 5)]):
+            sha256, file_size = store.put([self.image(size, pattern)])
+            Photo.objects.create(photo_url=PHOTO_URL + str(i), sha256=sha256,
+                                 width=size[0], height=size[1])
+        with override_settings(PHOTO_STORE=directory.name):
+            call_command('dedupe_photos', workers=2)
+        photos = list(Photo.objects.order_by('id'))
+        assert all(p.phash for p in photos)
+        # The smaller copy of the first image is deleted
+        assert [p.deleted for p in photos] == [False, True, False]
+
+    def test_dedupe_groups(self):
+        from scraping.management.commands.dedupe_photos import Command
+        now = tz.now()
+        # b is near a and c, but a and c aren't near each other. a is kept
+        # over b, as it's older, so c has to be kept too.
+        a, b, c = (Photo.objects.create(photo_url=PHOTO_URL + str(i),
+                                        phash=phash.to_hex(hash), likes=1,
+                                        posted=now - timedelta(days=days))
+                   for i, (hash, days) in enumerate([(0, 2),
+                                                     (0b111, 1),
+                                                     (0b111111, 3)]))
+        c.likes = 0
+        c.save()
+        assert Command().find_groups(3) == [(a.id, [b.id])]
+        assert Command().find_groups(6) == [(a.id, [b.id, c.id])]
+        # The oldest post is kept, whatever the ids
+        a.posted = now
+        a.save()
+        assert Command().find_groups(3) == [(b.id, [a.id, c.id])]
+
+
+class ReindexTest(TestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+
+    def test_analyze(self):
+        words, ngrams = analyze(PHOTO_CAPTION, ['big cats', 'lions'])
+        assert words['lion'] == 2
+        assert words['cat'] == 1
+        assert ('big', 'cat') in ngrams
+        assert ('little', 'lion', 'frolic') in ngrams
+
+    def test_analyze_tags_once(self):
+        caption = ' '.join(['little lions frolicking'] * 10)
+        with instrumentation.profiling('test') as profile:
+            words, ngrams = analyze(caption, ['big cats'])
+        # Once for the caption and once for the tag, not once per ngram
+        assert profile.stages['pos_tag']['calls'] == 2
+        assert len(ngrams) == 1 + 29 + 28
+        assert ('lion', 'frolic', 'little') in ngrams
+
+    def test_reindex(self):
+        for i, post in enumerate(make_posts(6)):
+            photo = Photo.objects.create(photo_url=PHOTO_URL + str(i),
+                                         caption=post['caption'])
+            photo.tags_from_ary(post['tags'])
+        photo = Photo.objects.get(photo_url=PHOTO_URL + '0')
+        photo.make_ngrams()
+        words = set(photo.wordassociation_set
+                    .values_list('word__word_str', 'strength'))
+        ngrams = set(photo.ngrams.values_list('expression', flat=True))
+        call_command('reindex', workers=2, chunk_size=4, batch_size=3)
+        # Reindexing a photo changes nothing
+        assert set(photo.wordassociation_set.values_list(
+            'word__word_str', 'strength')) == words
+        assert set(photo.ngrams.values_list('expression',
+                                            flat=True)) == ngrams
+        for photo in Photo.objects.all():
+            assert photo.wordassociation_set.exists()
+            assert photo.ngrams.exists()
+            assert Posting.objects.filter(photo=photo).exists()
+
+    def test_incremental(self):
+        photos = []
+        for i, caption in enumerate(['Little lions playing',
+                                     'Sleeping elephants']):
+            photos.append(Photo.objects.create(photo_url=PHOTO_URL + str(i),
+                                               caption=caption))
+        call_command('reindex', workers=1)
+        fingerprints = dict(Photo.objects.values_list('id',
+                                                      'nlp_fingerprint'))
+        assert all(fingerprints.values())
+        # Only the changed photo is processed, and its old words and ngrams
+        # are replaced
+        Photo.objects.filter(id=photos[0].id).update(
+            caption='Little cubs playing')
+        call_command('reindex', workers=1)
+        words = set(WordAssociation.objects.filter(photo=photos[0])
+                    .values_list('word__word_str', flat=True))
+        assert 'cub' in words and 'lion' not in words
+        assert not photos[0].ngrams.filter(expression='little lion').exists()
+        new_fingerprints = dict(Photo.objects.values_list('id',
+                                                          'nlp_fingerprint'))
+        assert new_fingerprints[photos[0].id] != fingerprints[photos[0].id]
+        assert new_fingerprints[photos[1].id] == fingerprints[photos[1].id]
+
+    def test_make_ngrams_twice(self):
+        photo = Photo.objects.create(photo_url=PHOTO_URL,
+                                     caption='Little lions playing')
+        photo.make_ngrams()
+        counts = (photo.ngrams.count(), photo.wordassociation_set.count())
+        photo.make_ngrams()
+        assert (photo.ngrams.count(),
+                photo.wordassociation_set.count()) == counts
+
+
+class StartupTest(TestCase):
+
+    # Seconds a fresh interpreter may take to set up Django and import the
+    # app. Without lazy imports it takes about three times as long as with.
+    BUDGET = 1.0
+
+    def test_startup(self):
+        results = startup.measure(runs=3)
+        assert results['heavy'] == []
+        assert min(results['seconds']) < self.BUDGET
+
+
+class SourceStatsTest(TestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+        self.blog = TumblrBlog.objects.create(url='http://synthetic.tumblr.com/',
+                                              name='Synthetic')
+
+    def test_stats(self):
+        posts = make_posts(30, notes=6)
+        photos = [d for post in posts
+                  for d in Photo.from_tumblr_api(post, self.blog)]
+        Photo.save_batch(photos[:20])
+        Photo.save_batch(photos[10:])
+        Photo.objects.filter(id__in=Photo.objects.values_list('id', flat=True)
+                             [:3]).update(deleted=True)
+        blog = TumblrBlog.objects.get(id=self.blog.id)
+        Source.update_stats()
+        rebuilt = TumblrBlog.objects.get(id=self.blog.id)
+        fields = ['photo_count', 'oldest_posted', 'newest_posted',
+                  'total_likes']
+        assert ([getattr(blog, f) for f in fields] ==
+                [getattr(rebuilt, f) for f in fields])
+        assert rebuilt.photo_count == 30
+        assert rebuilt.deleted_count == 3
+        assert rebuilt.total_likes == sum(d['photo'].likes for d in photos)
+
+    def test_likes_change(self):
+        posts = make_posts(2, notes=6)
+        Photo.save_batch([d for post in posts
+                          for d in Photo.from_tumblr_api(post, self.blog)])
+        posts[0]['notes'] = posts[0]['notes'][:1]
+        Photo.save_batch(Photo.from_tumblr_api(posts[0], self.blog))
+        blog = TumblrBlog.objects.get(id=self.blog.id)
+        assert blog.total_likes == sum(
+            Photo.objects.values_list('likes', flat=True))
+
+
+class SchemaTest(TestCase):
+
+    def test_indexes(self):
+        # The migrations add every index
+        assert schema.missing() == []
+        photo = Photo.objects.create(photo_url=PHOTO_URL)
+        word = Word.objects.create(word_str='lion')
+        WordAssociation.objects.create(photo=photo, word=word)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                WordAssociation.objects.create(photo=photo, word=word)
+
+
+class DatabaseTest(TestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA {}'.format(name))
+            return cursor.fetchone()[0]
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_pragmas(self):
+        assert self.pragma('cache_size') == -64 * 1024
+        assert self.pragma('temp_store') == 2
+
+    def test_bulk_insert(self):
+        words = [Word(word_str='word{}'.format(i))
+                 for i in range(database.COPY_THRESHOLD + 1)]
+        database.bulk_insert(Word, words)
+        assert Word.objects.count() == len(words)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                database.bulk_insert(Word, words)
+        database.bulk_insert(Tag, [Tag(tag_str='')])
+        assert Tag.objects.get().tag_str == ''
+
+    def test_ingest(self):
+        with database.ingest():
+            Word.objects.create(word_str='lion')
+        assert Word.objects.filter(word_str='lion').exists()
+
+    def test_csv_value(self):
+        assert database.csv_value(None) == '\\N'
+        assert database.csv_value('') == '""'
+        assert database.csv_value('a "big", cat') == '"a ""big"", cat"'
+        assert database.csv_value(3) == '"3"'
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    def test_copy(self):
+        photos = [Photo(photo_url=PHOTO_URL + str(i), title='',
+                        caption='a "big", cat\n{}'.format(i))
+                  for i in range(3)]
+        database.copy(Photo, photos, chunk_size=2)
+        saved = list(Photo.objects.order_by('photo_url'))
+        assert [p.caption for p in saved] == [p.caption for p in photos]
+        assert all(p.title == '' and p.posted is None for p in saved)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                database.copy(Photo, photos[:1])
+
+
+# Checks the settings ingest changes, which only apply outside the test
+# transaction
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+class IngestSettingsTest(TransactionTestCase):
+
+    def setting(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW synchronous_commit')
+            return cursor.fetchone()[0]
+
+    def test_synchronous_commit(self):
+        with database.ingest():
+            assert self.setting() == 'off'
+        assert self.setting() == 'on'
+
+
+class FeedTest(TestCase):
+
+    def setUp(self):
+        self.blog = TumblrBlog.objects.create(url='http://a.tumblr.com/',
+                                              name='a')
+        other = TumblrBlog.objects.create(url='http://b.tumblr.com/',
+                                          name='b')
+        lions = Tag.objects.create(tag_str='lions')
+        posted = tz.now()
+        for i in range(7):
+            # Pairs posted at the same time, so pages split ties by id
+            photo = Photo.objects.create(
+                source=self.blog if i % 3 else other,
+                posted=posted - timedelta(hours=i // 2),
+                photo_url='http://x/{}.jpg'.format(i), rating=i % 5,
+                deleted=i == 6)
+            photo.tags.add(lions, Tag.objects.create(tag_str='lion' + 'abcdefg'[i]))
+
+    def feed(self, **params):
+        response = self.client.get('/photos/', params)
+        assert response.status_code == 200
+        return response.json()
+
+    def test_pages(self):
+        ids = []
+        after = None
+        # The page, its tags and the newest change, however long the page
+        with self.assertNumQueries(3):
+            page = self.feed(limit=2)
+        while True:
+            ids += [p['id'] for p in page['photos']]
+            assert all('lions' in p['tags'] for p in page['photos'])
+            after = page['next']
+            if after is None:
+                break
+            page = self.feed(limit=2, after=after)
+        expected = list(Photo.objects.filter(deleted=False)
+                        .order_by('-posted', '-id').values_list('id',
+                                                                flat=True))
+        assert ids == expected
+
+    def test_filters(self):
+        assert {p['source'] for p in self.feed(source='b')['photos']} == {'b'}
+        assert [p['tags'] for p in self.feed(tag='lionb')['photos']] == [
+            ['lionb', 'lions']]
+        assert len(self.feed(tag=['lions', 'lionc'])['photos']) == 1
+        assert {p['rating'] for p in self.feed(min_rating=3)['photos']} == {
+            3, 4}
+        assert [p['deleted'] for p in self.feed(deleted='true')['photos']] == [
+            True]
+        assert len(self.feed(deleted='any')['photos']) == 7
+        for params in [{'limit': 0}, {'after': 'x'}, {'deleted': 'no'}]:
+            assert self.client.get('/photos/', params).status_code == 400
+
+    def test_revalidation(self):
+        response = self.client.get('/photos/')
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        assert self.client.get('/photos/', HTTP_IF_NONE_MATCH=etag
+                               ).status_code == 304
+        # Answered without looking at the photos
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/photos/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert response.status_code == 304
+        Photo.objects.filter(rating=4).update(
+            rating=5, modified=tz.now() + timedelta(minutes=1))
+        response = self.client.get('/photos/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    def test_words_and_tags_modify(self):
+        Photo.objects.update(modified=tz.now() - timedelta(hours=1))
+        photo = Photo.objects.filter(deleted=False)[0]
+        for params, change in [
+                ({'word': 'lion'},
+                 lambda: Photo.save_words({photo.id: {'lion': 1}})),
+                ({'tag': 'cubs'}, lambda: photo.tags_from_ary(['cubs']))]:
+            response = self.client.get('/photos/', params)
+            assert response.json()['photos'] == []
+            change()
+            response = self.client.get(
+                '/photos/', params,
+                HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            assert response.status_code == 200
+            assert [p['id'] for p in response.json()['photos']] == [photo.id]
+            Photo.objects.update(modified=tz.now() - timedelta(hours=1))
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.blog = TumblrBlog.objects.create(url='http://a.tumblr.com/',
+                                              name='a')
+        lion = Word.objects.create(word_str='lion')
+        ngram = Ngram.objects.create(expression='little lion')
+        for i in range(3):
+            photo = Photo.objects.create(
+                source=self.blog, posted=tz.now(), deleted=i == 2,
+                photo_url='http://x/{}.jpg'.format(i))
+            photo.tags.add(Tag.objects.create(tag_str='lion' + 'abc'[i]))
+            WordAssociation.objects.create(photo=photo, word=lion,
+                                           strength=i + 1)
+            photo.ngrams.add(ngram)
+
+    def export(self, format, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'photos.' + format)
+            call_command('export', path, '--chunk-size', '2', *args)
+            with open(path, newline='') as f:
+                return f.read()
+
+    def test_chunks(self):
+        # Four queries per chunk, and one finding there are no more
+        with self.assertNumQueries(9):
+            chunks = list(export.chunks(Photo.objects.all(), 2))
+        assert [len(c) for c in chunks] == [2, 1]
+        photo = chunks[0][1]
+        assert photo['source'] == 'a'
+        assert photo['tags'] == ['lionb']
+        assert photo['words'] == {'lion': 2}
+        assert photo['ngrams'] == ['little lion']
+
+    def test_jsonl(self):
+        lines = self.export('jsonl', '--exclude-deleted').splitlines()
+        photos = [json.loads(line) for line in lines]
+        assert [p['tags'] for p in photos] == [['liona'], ['lionb']]
+        assert photos[0]['words'] == {'lion': 1}
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export(
+            'csv', '--since', '2000-01-01'))))
+        assert len(rows) == 3
+        assert json.loads(rows[2]['words']) == {'lion': 3}
+        assert rows[2]['deleted'] == 'True'
+
+    def test_parquet(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest('Needs pyarrow')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'photos.parquet')
+            call_command('export', path, '--chunk-size', '2')
+            parquet = pq.ParquetFile(path)
+            assert parquet.num_row_groups == 2
+            columns = parquet.read(['tags', 'words']).to_pydict()
+        assert columns['words'][1] == [{'word': 'lion', 'strength': 2}]
+        assert columns['tags'][2] == ['lionc']
+
+
+class IngestTest(TestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+        self.posts = make_posts(45)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'posts.jsonl')
+        with open(self.path, 'w') as f:
+            for post in self.posts:
+                f.write(json.dumps(post) + '\n')
+            f.write('not a post\n')
+
+    def ingest(self, *args):
+        call_command('ingest', self.path, '--batch-size', '10', *args)
+
+    def test_ingest(self):
+        self.ingest('--workers', '1')
+        blog = TumblrBlog.objects.get()
+        assert blog.name == 'synthetic'
+        assert blog.photo_count == 45
+        assert Photo.objects.filter(source=blog).count() == 45
+        photo = Photo.objects.get(post_url=self.posts[0]['post_url'])
+        assert photo.likes == Photo.count_likes(self.posts[0])
+        assert photo.tags.count() == len(self.posts[0]['tags'])
+
+    def test_rerun(self):
+        self.ingest('--workers', '2')
+        # Saving the same posts again changes nothing
+        self.ingest('--workers', '2')
+        assert Photo.objects.count() == 45
+        assert TumblrBlog.objects.get().photo_count == 45
+
+    def test_source(self):
+        blog = TumblrBlog.objects.create(url='http://other.tumblr.com/',
+                                         name='other')
+        self.ingest('--workers', '1', '--source', 'other')
+        assert Photo.objects.filter(source=blog).count() == 45
+        assert TumblrBlog.objects.count() == 1
+
+
+class MigrationTest(TransactionTestCase):
+
+    # Migrates the database to a migration of the app, or the latest if None.
+    # Returns the models as they were at it.
+    def migrate(self, name=None):
+        executor = MigrationExecutor(connection)
+        if name is None:
+            target = executor.loader.graph.leaf_nodes('scraping')
+        else:
+            target = [('scraping', name)]
+        executor.migrate(target)
+        executor.loader.build_graph()
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        self.migrate()
+
+    def test_dedupe_ngrams_on_old_database(self):
+        # The schema before ngrams had digests, with an ngram stored twice
+        old = self.migrate('0001_initial')
+        old_photo = old.get_model('scraping', 'Photo').objects.create(
+            photo_url=PHOTO_URL)
+        words = [old.get_model('scraping', 'Word').objects.create(
+            word_str=w) for w in ['little', 'lion']]
+        for _ in range(2):
+            ngram = old.get_model('scraping', 'Ngram').objects.create(
+                expression='little lion')
+            for order, word in enumerate(words):
+                old.get_model('scraping', 'NgramAssociation').objects.create(
+                    ngram=ngram, word=word, order=order)
+            old_photo.ngrams.add(ngram)
+        self.migrate()
+        call_command('dedupe_ngrams')
+        ngram = Ngram.objects.get()
+        assert ngram.digest == Ngram.make_digest('little lion')
+        assert list(Photo.objects.get().ngrams.all()) == [ngram]
+
+    def test_duplicate_associations(self):
+        old = self.migrate('0009_source_stats')
+        photo = old.get_model('scraping', 'Photo').objects.create(
+            photo_url=PHOTO_URL)
+        word = old.get_model('scraping', 'Word').objects.create(
+            word_str='lion')
+        for strength in [2, 1]:
+            old.get_model('scraping', 'WordAssociation').objects.create(
+                photo=photo, word=word, strength=strength)
+        # The first is kept so the unique constraint can be added
+        self.migrate()
+        assert WordAssociation.objects.get().strength == 2
+
+
+class RateLimiterTest(TestCase):
+
+    def test_per_host(self):
+        throttle = RateLimiter(per_host=20)
+        start = time.monotonic()
+        throttle.wait('http://a.tumblr.com/')
+        throttle.wait('http://b.tumblr.com/')
+        assert time.monotonic() - start < 0.05
+        throttle.wait('http://a.tumblr.com/')
+        assert time.monotonic() - start >= 0.05
+
+
+class PipelineTest(TestCase):
+
+    def test_prefetch(self):
+        assert list(pipeline.prefetch(range(10), 2)) == list(range(10))
+
+    def test_prefetch_error(self):
+        def pages():
+            yield 1
+            raise ValueError('no more pages')
+        items = pipeline.prefetch(pages())
+        assert next(items) == 1
+        with self.assertRaises(ValueError):
+            next(items)
+
+    def test_batched(self):
+        assert list(pipeline.batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+class InstrumentationTest(TestCase):
+
+    def test_profiled(self):
+        @instrumentation.profiled('count_sources')
+        def count_sources():
+            return Source.objects.count()
+        finished = []
+        instrumentation.add_hook(finished.append)
+        try:
+            with instrumentation.profiling('test') as profile:
+                count_sources()
+                count_sources()
+        finally:
+            instrumentation.remove_hook(finished.append)
+        assert profile.stages['count_sources']['calls'] == 2
+        assert profile.stages['count_sources']['queries'] == 2
+        assert finished == [profile]
+
+    def test_not_profiling(self):
+        @instrumentation.profiled('add')
+        def add(a, b):
+            return a + b
+        assert add(1, 2) == 3
+        assert instrumentation.current() is None
+
+
+class ScrapeProgressTest(TestCase):
+
+    def setUp(self):
+        self.blog = TumblrBlog(url='http://' + BLOG_NAME + '.tumblr.com/')
+        self.blog.save()
+
+    def test_passes(self):
+        progress = ScrapeProgress.start(self.blog)
+        assert progress.in_progress
+        assert progress.cutoff == 0
+        assert progress.oldest() is None
+        progress.advance([{'timestamp': 30, 'id': 3},
+                          {'timestamp': 20, 'id': 2}])
+        progress.save()
+        # Resumes the unfinished pass
+        progress = ScrapeProgress.start(self.blog)
+        assert progress.oldest() == (20, 2)
+        progress.in_progress = False
+        progress.save()
+        # Starts a new pass that stops at the newest post seen
+        progress = ScrapeProgress.start(self.blog)
+        assert progress.cutoff_post() == (30, 3)
+        assert progress.oldest() is None
+
+
+class SaveBatchTest(TestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+        self.blog = TumblrBlog(url='http://' + BLOG_NAME + '.tumblr.com/')
+        self.blog.save()
+
+    def test_save_batch(self):
+        counts = Photo.save_batch(Photo.from_tumblr_api(POST, self.blog))
+        assert counts == {'inserted': 1, 'updated': 0, 'skipped': 0}
+        photo = Photo.objects.get(photo_url=PHOTO_URL)
+        assert photo.tags.count() == 5
+        # The same photo again is skipped
+        counts = Photo.save_batch(Photo.from_tumblr_api(POST, self.blog))
+        assert counts == {'inserted': 0, 'updated': 0, 'skipped': 1}
+        # And updated if its likes have changed
+        photo_data = Photo.from_tumblr_api(POST, self.blog)
+        photo_data[0]['photo'].likes += 1
+        counts = Photo.save_batch(photo_data)
+        assert counts == {'inserted': 0, 'updated': 1, 'skipped': 0}
+        assert Photo.objects.get().likes == photo.likes + 1
+        assert Photo.objects.get().tags.count() == 5
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.fetched = []
+
+    def fetch(self):
+        self.fetched.append(1)
+        return {'posts': [POST]}
+
+    def test_cache(self):
+        cache = ResponseCache(self.directory)
+        params = {'limit': 20}
+        assert cache.get(self.fetch, 'posts', BLOG_NAME, params) == {
+            'posts': [POST]}
+        assert cache.get(self.fetch, 'posts', BLOG_NAME, params) == {
+            'posts': [POST]}
+        assert len(self.fetched) == 1
+        cache.get(self.fetch, 'posts', BLOG_NAME, {'limit': 10})
+        assert len(self.fetched) == 2
+
+    def test_ttl(self):
+        cache = ResponseCache(self.directory, ttl=0)
+        cache.get(self.fetch, 'posts', BLOG_NAME)
+        time.sleep(0.01)
+        cache.get(self.fetch, 'posts', BLOG_NAME)
+        assert len(self.fetched) == 2
+
+    def test_replay(self):
+        ResponseCache(self.directory, mode='record').get(
+            self.fetch, 'posts', BLOG_NAME)
+        cache = ResponseCache(self.directory, mode='replay', ttl=0)
+        assert cache.get(self.fetch, 'posts', BLOG_NAME) == {'posts': [POST]}
+        with self.assertRaises(CacheMiss):
+            cache.get(self.fetch, 'info', BLOG_NAME)
+        assert len(self.fetched) == 1
+
+    def test_evict(self):
+        cache = ResponseCache(self.directory, max_size=1)
+        cache.get(self.fetch, 'posts', BLOG_NAME)
+        assert cache._files() == []
+
+
+class ScrapeTest(TestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+        self.posts = make_posts(45)
+        self.client = StandInClient(self.posts)
+        self.addCleanup(tumblr.set_client, tumblr.set_client(self.client))
+        self.blog = TumblrBlog(url='http://synthetic.tumblr.com/')
+        self.blog.save()
+
+    def test_scrape(self):
+        counts = self.blog.scrape(all=True)
+        assert counts == {'inserted': 45, 'updated': 0, 'skipped': 0}
+        assert Photo.objects.count() == 45
+        assert not ScrapeProgress.objects.get().in_progress
+
+    def test_stats(self):
+        self.blog.scrape(all=True)
+        self.blog.reset_scraping()
+        blog = Source.objects.get(id=self.blog.id)
+        assert blog.photo_count == 45
+        assert blog.total_likes == sum(p.likes for p in Photo.objects.all())
+        assert blog.total_likes > 0
+        assert blog.newest_posted == tz.make_aware(
+            dt.fromtimestamp(self.posts[0]['timestamp']))
+        assert blog.last_scrape_duration is not None
+
+    def test_resume(self):
+        self.blog.scrape(all=False, max_depth=1)
+        assert Photo.objects.count() == 20
+        assert ScrapeProgress.objects.get().in_progress
+        self.blog.scrape(all=True)
+        assert Photo.objects.count() == 45
+        # Nothing new, so only the first page is fetched
+        calls = self.client.calls
+        assert self.blog.scrape(all=True)['inserted'] == 0
+        assert self.client.calls == calls + 1
+
+    def test_same_second(self):
+        self.blog.scrape(all=True)
+        # Posts made since, one in the same second as the newest post
+        # scraped
+        new_posts = make_posts(47)[:2]
+        new_posts[0]['timestamp'] = self.posts[0]['timestamp'] + 60
+        new_posts[1]['timestamp'] = self.posts[0]['timestamp']
+        self.client.posts = new_posts + self.posts
+        assert self.blog.scrape(all=True)['inserted'] == 2
+
+    def test_depth_limited(self):
+        self.blog.scrape(all=False, max_depth=1)
+        new_post = make_posts(46)[0]
+        new_post['timestamp'] = self.posts[0]['timestamp'] + 60
+        self.client.posts = [new_post] + self.posts
+        # The pass carries on back through older posts, and the new post
+        # waits until it's finished
+        while ScrapeProgress.objects.get().in_progress:
+            self.blog.scrape(all=False, max_depth=1)
+        assert Photo.objects.count() == 45
+        assert self.blog.scrape(all=False, max_depth=1)['inserted'] == 1
+
+    def test_no_notes(self):
+        self.blog.scrape(all=True, notes=False)
+        photo = Photo.objects.all()[0]
+        assert photo.likes == 0
+        assert photo.note_count == 50
+        assert self.blog.refresh_likes([photo]) == 1
+        assert Photo.objects.get(id=photo.id).likes > 0
+
+
+# Stands in for the Tumblr API for several blogs, each with its own posts and
+# photos.
+class BlogsClient(object):
+
+    def __init__(self, names, count):
+        self.clients = {}
+        for name in names:
+            posts = make_posts(count, blog_name=name)
+            for post in posts:
+                for photo in post['photos']:
+                    for size in [photo['original_size']] + photo['alt_sizes']:
+                        size['url'] = size['url'].replace(
+                            'tumblr_synthetic', 'tumblr_' + name)
+            self.clients['http://{}.tumblr.com/'.format(name)] = \
+                StandInClient(posts)
+
+    def get(self, endpoint, blog_url=None, params=None):
+        return self.clients[blog_url].get(endpoint, blog_url, params)
+
+
+# Scrapes on a database file, as the in-memory test database doesn't lock the
+# way a file does.
+class ParallelScrapeTest(TransactionTestCase):
+
+    def setUp(self):
+        vocabulary.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Every thread's connection, this one's included, opens the file
+        self.databases = connections.databases['default']
+        self.memory = connections['default']
+        connections.databases['default'] = dict(
+            self.databases, NAME=os.path.join(directory.name, 'db.sqlite3'))
+        del connections['default']
+        call_command('migrate', verbosity=0)
+        names = ['blog' + c for c in 'abcd']
+        self.addCleanup(tumblr.set_client,
+                        tumblr.set_client(BlogsClient(names, 45)))
+        for name in names:
+            TumblrBlog.objects.create(
+                url='http://{}.tumblr.com/'.format(name), name=name)
+
+    def tearDown(self):
+        connection.close()
+        connections.databases['default'] = self.databases
+        connections['default'] = self.memory
+        vocabulary.clear()
+
+    def test_workers(self):
+        call_command('scrape', all=True, workers=4)
+        assert Photo.objects.count() == 4 * 45
+        assert ScrapeProgress.objects.filter(in_progress=False).count() == 4
+        assert sorted(Source.objects.values_list('photo_count', flat=True)
+                      ) == [45] * 4
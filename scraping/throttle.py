@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+from urllib.parse import urlparse
+import time
+
+
+# Spaces out requests so they stay under a global rate and a rate per host.
+# Safe to share between threads; each caller reserves the next free slot and
+# sleeps until it comes round.
+#   rate (float):
+#       the maximum number of requests per second overall. None for no limit.
+#   per_host (float):
+#       the maximum number of requests per second to any one host. None for
+#       no limit.
+class RateLimiter(object):
+
+    def __init__(self, rate=None, per_host=None):
+        self.rate = rate
+        self.per_host = per_host
+        self._lock = Lock()
+        self._next = 0
+        self._next_by_host = {}
+
+    # Blocks until a request can be made.
+    #   url (str):
+    #       the url (or just the host name) the request is for. For Tumblr
+    #       API calls this is the blog's url, so each blog is limited
+    #       separately.
+    def wait(self, url=None):
+        host = (urlparse(url).hostname or url) if url else None
+        with self._lock:
+            now = time.monotonic()
+            start = now
+            # Start at the first moment both limits allow
+            if self.rate:
+                start = max(start, self._next)
+            if self.per_host and host:
+                start = max(start, self._next_by_host.get(host, 0))
+            # Reserve the slot
+            if self.rate:
+                self._next = start + 1 / self.rate
+            if self.per_host and host:
+                self._next_by_host[host] = start + 1 / self.per_host
+        if start > now:
+            time.sleep(start - now)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from threading import Lock, local
+from django.conf import settings
+from scraping.http_cache import ResponseCache
+import os
+
+
+# Makes calls to the Tumblr API through pooled, kept-alive connections.
+# Safe to share between threads: each thread gets its own tumblpy agent, but
+# they all share one connection pool. Failed requests (connection errors,
+# 429s and 5xxs) are retried with exponential backoff. tumblpy, requests and
+# the keys are only imported when first needed, so importing this is cheap.
+#   keys (dict):
+#       the consumer key and secret. Defaults to the ones in api_keys.py.
+#   pool_size (int):
+#       the maximum number of connections kept open to each host.
+#   timeout (tuple):
+#       the connect and read timeouts in seconds.
+#   retries (int):
+#       the maximum number of times to retry a request.
+#   backoff (float):
+#       urllib3's backoff factor, in seconds. The first retry is made at
+#       once, and each retry n after it waits backoff * 2 ** (n - 1): with 0.5,
+#       the second waits 1 second and the third 2.
+#   cache (ResponseCache):
+#       if given, responses are served from and stored in it.
+class TumblrClient(object):
+
+    def __init__(self, keys=None, pool_size=10, timeout=(5, 30), retries=3,
+                 backoff=0.5, cache=None):
+        from scraping.adapters import pooled_adapter
+        if keys is None:
+            from api_keys import TUMBLR as keys
+        self.keys = keys
+        self.cache = cache
+        self._adapter = pooled_adapter(pool_size, timeout, retries, backoff)
+        self._local = local()
+
+    # Returns this thread's tumblpy agent.
+    def agent(self):
+        agent = getattr(self._local, 'agent', None)
+        if agent is None:
+            from tumblpy import Tumblpy
+            agent = Tumblpy(self.keys['consumer'], self.keys['secret'])
+            agent.client.mount('https://', self._adapter)
+            agent.client.mount('http://', self._adapter)
+            self._local.agent = agent
+        return agent
+
+    # Calls the API, like Tumblpy.get.
+    #   endpoint (str):
+    #       e.g. 'posts' or 'info'.
+    #   blog_url (str):
+    #       the blog's url or name.
+    #   params (dict):
+    #       the query parameters.
+    def get(self, endpoint, blog_url=None, params=None):
+        def fetch():
+            return self.agent().get(endpoint, blog_url, params=params)
+        if self.cache:
+            return self.cache.get(fetch, endpoint, blog_url, params)
+        return fetch()
+
+
+_client = None
+_client_lock = Lock()
+
+
+# Returns the shared TumblrClient, configured by the TUMBLR_CLIENT setting (a
+# dict of TumblrClient's arguments, e.g. {'pool_size': 20}) and the
+# TUMBLR_CACHE setting (a dict of ResponseCache's arguments). The
+# TUMBLR_CACHE_MODE environment variable overrides the cache's mode.
+def client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TumblrClient(cache=make_cache(),
+                                   **getattr(settings, 'TUMBLR_CLIENT', {}))
+        return _client
+
+
+# Returns a ResponseCache configured by the TUMBLR_CACHE setting, or None if
+# caching is off.
+def make_cache():
+    options = dict(getattr(settings, 'TUMBLR_CACHE', {}))
+    options['mode'] = os.environ.get('TUMBLR_CACHE_MODE',
+                                     options.get('mode', 'off'))
+    if options['mode'] == 'off' or 'directory' not in options:
+        return None
+    return ResponseCache(**options)
+
+
+# Replaces the shared client, e.g. with a stand-in for tests. Returns the old
+# one. None makes the next call to client() create a fresh one.
+def set_client(new_client):
+    global _client
+    with _client_lock:
+        old_client, _client = _client, new_client
+        return old_client
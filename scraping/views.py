@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from django.db.models import Max, Q
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.utils import timezone as tz
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
+from scraping.models import Photo, Tag
+from calendar import timegm
+from collections import defaultdict
+from datetime import datetime as dt, timedelta
+import hashlib
+
+# The number of photos on a page unless the limit parameter says otherwise,
+# and the most a page can have
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# The fields of each photo in the feed, and the keys they're given
+FIELDS = [('id', 'id'), ('source__name', 'source'), ('post_url', 'post_url'),
+          ('photo_url', 'photo_url'), ('posted', 'posted'),
+          ('title', 'title'), ('caption', 'caption'), ('likes', 'likes'),
+          ('note_count', 'note_count'), ('rating', 'rating'),
+          ('deleted', 'deleted'), ('width', 'width'), ('height', 'height')]
+EPOCH = tz.make_aware(dt(1970, 1, 1), tz.utc)
+
+
+# A page of photos as JSON, newest first. Pages are found by the (posted, id)
+# of the last photo on the one before rather than an offset, so each is a
+# short index scan however deep it is. Photos without a posted date aren't
+# included. Parameters:
+#   source:
+#       only photos from sources with this name. Can be given more than once.
+#   tag:
+#       only photos with this tag. Given more than once, photos need all of
+#       them.
+#   word:
+#       only photos with this word, as lemmatized in the photos' words. Given
+#       more than once, photos need all of them.
+#   rating, min_rating:
+#       only photos with exactly or at least this rating.
+#   deleted:
+#       'false' (the default), 'true', or 'any' for both.
+#   limit:
+#       the number of photos on the page.
+#   after:
+#       the 'next' value of the page before.
+# Responds with {'photos': [...], 'next': cursor}, where next is None on the
+# last page. Clients can revalidate with If-Modified-Since, which skips the
+# page's queries if no photo has changed, or If-None-Match.
+@require_GET
+def photo_feed(request):
+    try:
+        photos = filter_photos(Photo.objects.all(), request.GET)
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise ValueError('limit must be between 1 and {}'
+                             .format(MAX_PAGE_SIZE))
+        after = request.GET.get('after')
+        after = parse_cursor(after) if after else None
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    modified = Photo.objects.aggregate(Max('modified'))['modified__max']
+    last_modified = modified and timegm(modified.utctimetuple())
+    response = get_conditional_response(request, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse(feed_page(photos, limit, after))
+        etag = hashlib.sha1(response.content).hexdigest()
+        response = get_conditional_response(request, etag, last_modified,
+                                            response)
+        response['ETag'] = quote_etag(etag)
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    # Caches may keep pages, but must check they're still current
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+# Returns photos filtered by a feed request's parameters. Raises ValueError
+# if they're invalid.
+#   params (QueryDict):
+#       the request's parameters.
+def filter_photos(photos, params):
+    photos = photos.filter(posted__isnull=False)
+    if params.getlist('source'):
+        photos = photos.filter(source__name__in=params.getlist('source'))
+    # The associations are unique per photo, so these joins can't repeat
+    # photos
+    for tag in params.getlist('tag'):
+        photos = photos.filter(tags__tag_str=Tag.clean(tag))
+    for word in params.getlist('word'):
+        photos = photos.filter(associated_words__word_str=word.lower())
+    if 'rating' in params:
+        photos = photos.filter(rating=int(params['rating']))
+    if 'min_rating' in params:
+        photos = photos.filter(rating__gte=int(params['min_rating']))
+    deleted = params.get('deleted', 'false')
+    if deleted not in ('true', 'false', 'any'):
+        raise ValueError("deleted must be 'true', 'false' or 'any'")
+    if deleted != 'any':
+        photos = photos.filter(deleted=deleted == 'true')
+    return photos
+
+
+# Returns a page of photos as a dict for the feed. Takes two queries however
+# long the page is, one for the photos and one for their tags.
+#   after (tuple):
+#       the (posted, id) of the last photo on the page before, or None for
+#       the first page.
+def feed_page(photos, limit, after=None):
+    if after:
+        posted, photo_id = after
+        photos = photos.filter(Q(posted__lt=posted) |
+                               Q(posted=posted, id__lt=photo_id))
+    # One more than the page, to tell whether there's another
+    rows = list(photos.order_by('-posted', '-id')
+                .values_list(*[f for f, _ in FIELDS])[:limit + 1])
+    more = len(rows) > limit
+    page = [dict(zip([key for _, key in FIELDS], row)) for row in rows[:limit]]
+    tags = defaultdict(list)
+    for photo_id, tag_str in (Photo.tags.through.objects
+                              .filter(photo_id__in=[p['id'] for p in page])
+                              .values_list('photo_id', 'tag__tag_str')):
+        tags[photo_id].append(tag_str)
+    for photo in page:
+        photo['tags'] = sorted(tags[photo['id']])
+    return {'photos': page,
+            'next': make_cursor(page[-1]['posted'], page[-1]['id'])
+            if more else None}
+
+
+# Returns the cursor for the page after a photo, as a string of its posted
+# time in microseconds since the epoch and its id.
+def make_cursor(posted, photo_id):
+    return '{}_{}'.format((posted - EPOCH) // timedelta(microseconds=1),
+                          photo_id)
+
+
+# Returns the (posted, id) a cursor from make_cursor was made from. Raises
+# ValueError if it isn't one.
+def parse_cursor(cursor):
+    try:
+        microseconds, photo_id = (int(part) for part in cursor.split('_'))
+    except ValueError:
+        raise ValueError('Invalid cursor {!r}'.format(cursor))
+    return EPOCH + timedelta(microseconds=microseconds), photo_id
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from threading import Lock
+from django.apps import apps
+from django.db import IntegrityError, transaction
+
+
+# Resolves strings to the ids of the rows holding them in a lookup table (e.g.
+# Word or Tag), creating any rows that are missing. Whole batches of strings
+# are resolved with one query plus one bulk insert, and the ids are kept in a
+# bounded in-process cache so common strings don't go back to the database.
+# Ids are only cached once the transaction they were found in commits, so
+# other threads are never given rows that may yet be rolled back.
+#   model (str):
+#       the label of the model holding the strings, e.g. 'scraping.Word'.
+#       Looked up lazily so this module can be imported by the models.
+#   field (str):
+#       the name of the model's unique string field.
+#   max_size (int):
+#       the maximum number of strings to keep in the cache. The least recently
+#       used ones are dropped first.
+class Vocabulary(object):
+
+    # Strings per query. SQLite allows at most 999 parameters per query.
+    chunk_size = 500
+
+    def __init__(self, model, field, max_size=100000):
+        self.model_label = model
+        self.field = field
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    # Returns a dict mapping each string to the id of its row.
+    #   strings (iterable):
+    #       the strings to look up. Rows are created for any that don't exist.
+    def ids(self, strings):
+        return self.get_or_create(strings)[0]
+
+    # Like ids, but returns a tuple (ids, created) where created is the list
+    # of strings whose rows had to be created.
+    #   defaults (dict):
+    #       optionally maps strings to dicts of other field values to give
+    #       their rows if they have to be created.
+    def get_or_create(self, strings, defaults=None):
+        ids = {}
+        missing = []
+        with self._lock:
+            for string in set(strings):
+                if string in self._cache:
+                    self._cache.move_to_end(string)
+                    ids[string] = self._cache[string]
+                else:
+                    missing.append(string)
+        created = []
+        if missing:
+            found = self._fetch(missing)
+            to_create = [s for s in missing if s not in found]
+            if to_create:
+                created = self._create(to_create, defaults or {})
+                found.update(self._fetch(to_create))
+            ids.update(found)
+            transaction.on_commit(lambda: self._remember(found))
+        return ids, created
+
+    # Empties the cache. Needed whenever rows may have been deleted from the
+    # database.
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _fetch(self, strings):
+        found = {}
+        for i in range(0, len(strings), self.chunk_size):
+            lookup = {self.field + '__in': strings[i:i + self.chunk_size]}
+            found.update(self.model.objects.filter(**lookup)
+                         .values_list(self.field, 'id'))
+        return found
+
+    # Creates rows for the strings and returns the list of strings whose rows
+    # were actually created.
+    def _create(self, strings, defaults):
+        model = self.model
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    [model(**dict(defaults.get(s, {}), **{self.field: s}))
+                     for s in strings],
+                    batch_size=self.chunk_size)
+            return strings
+        except IntegrityError:
+            # Someone else created some of them in the meantime, so fall back
+            # to creating them one at a time
+            created = []
+            for string in strings:
+                if model.objects.get_or_create(
+                        defaults=defaults.get(string),
+                        **{self.field: string})[1]:
+                    created.append(string)
+            return created
+
+    def _remember(self, ids):
+        with self._lock:
+            self._cache.update(ids)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+
+WORDS = Vocabulary('scraping.Word', 'word_str')
+TAGS = Vocabulary('scraping.Tag', 'tag_str')
+NGRAMS = Vocabulary('scraping.Ngram', 'digest')
+
+
+# Empties every shared cache.
+def clear():
+    WORDS.clear()
+    TAGS.clear()
+    NGRAMS.clear()